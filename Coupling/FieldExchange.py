@@ -0,0 +1,82 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["FieldExchange"]
+
+# Écritures asynchrones : un seul thread, les fichiers sont écrits dans l'ordre des demandes
+_writer = ThreadPoolExecutor(max_workers=1)
+_pending = []
+
+class FieldExchange:
+
+    # Format binaire colonne par colonne pour les champs échangés entre étapes :
+    # MAGIC | taille de l'en-tête (uint32) | en-tête JSON | colonnes contiguës alignées
+    MAGIC = b"MPFIELD1"
+    ALIGN = 64
+
+    def write(self, path, columns):
+
+        n = len(next(iter(columns.values())))
+        arrays = {name: np.ascontiguousarray(values) for name, values in columns.items()}
+        for name, arr in arrays.items():
+            if arr.shape != (n,):
+                raise ValueError(f"Colonne '{name}' de taille {arr.shape} au lieu de ({n},)")
+
+        layout = []
+        offset = 0
+        for name, arr in arrays.items():
+            layout.append({"name": name, "dtype": arr.dtype.newbyteorder("<").str, "offset": offset})
+            offset += -(-arr.nbytes // self.ALIGN) * self.ALIGN
+
+        header = json.dumps({"n": n, "columns": layout}).encode()
+        data_start = -(-(len(self.MAGIC) + 4 + len(header)) // self.ALIGN) * self.ALIGN
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(np.uint32(len(header)).tobytes())
+            f.write(header)
+            for col, arr in zip(layout, arrays.values()):
+                f.seek(data_start + col["offset"])
+                f.write(arr.astype(col["dtype"], copy=False).tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+
+    def read(self, path, columns=None):
+        # Colonnes renvoyées en np.memmap, sans copie ni conversion texte
+        with open(path, "rb") as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise RuntimeError(f"{path} n'est pas un fichier d'échange de champs.")
+            size = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+            header = json.loads(f.read(size))
+        data_start = -(-(len(self.MAGIC) + 4 + size) // self.ALIGN) * self.ALIGN
+
+        n = header["n"]
+        out = {}
+        for col in header["columns"]:
+            if columns is not None and col["name"] not in columns:
+                continue
+            out[col["name"]] = np.memmap(path, dtype=col["dtype"], mode="r",
+                                         offset=data_start + col["offset"], shape=(n,)) if n else np.empty(0, col["dtype"])
+        return out
+
+    def write_async(self, path, columns, csv_path=None):
+        # Écriture hors du chemin critique ; flush() attend la fin de toutes les écritures
+        columns = dict(columns)
+        def task():
+            self.write(path, columns)
+            if csv_path is not None:
+                self.write_csv(csv_path, columns)
+        _pending.append(_writer.submit(task))
+
+    def flush(self):
+
+        while _pending:
+            _pending.pop(0).result()
+
+    def write_csv(self, path, columns, float_format="%.8f"):
+        # Export texte optionnel (consommateurs externes, ex. fvOptions)
+        pd.DataFrame(columns).to_csv(path, index=False, float_format=float_format)
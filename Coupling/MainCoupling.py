@@ -2,6 +2,13 @@ from Neutronics.NeInputGenerator import NeInputGenerator
 from Neutronics.NeOutputReader import NeOutputReader
 from Thermohydraulics.ThInputGenerator import ThInputGenerator
 from Thermohydraulics.ThOutputReader import ThOutputReader
+from Coupling.FieldExchange import FieldExchange
+from Coupling.PicardController import PicardController
+from Coupling.StageCache import StageCache
+from Coupling.ThField import ThField
+from Coupling.PostProcessor import PostProcessor
+import numpy as np
+import os
 
 NIG = NeInputGenerator()
 NOR = NeOutputReader()
@@ -25,6 +32,37 @@ class MainCoupling:
         self._start_iteration = 1
         self._last_iteration = 1
         self._restart_from_NE = False
+        self._TH_workers = 0 #Processes for the TH voxel averaging (0 = serial historical sampling)
+        self._TH_parallel = False #Run buoyantSimpleFoam decomposed with mpirun
+        self._TH_nprocs = 0 #Subdomains of the parallel TH run (0 = available cores)
+        self._TH_warm_start = False #Start each TH run from the previous iteration's latest fields
+        self._TH_warm_end_time = 500 #SIMPLE iterations of a warm-started TH run
+        self._TH_residual_tolerances = {} #Early stop: max initial residual per field, e.g. {"h": 1e-6}
+        self._TH_monitor_tolerances = {} #Early stop: max change over the window, e.g. {"T_outlet": 0.01}
+        self._TH_stop_window = 20 #Consecutive solver steps within tolerance before stopping
+        self._TH_link_template = True #Hard-link the template mesh and fixed dictionaries into each TH case
+        self._NE_persistent_session = False #Keep one openmc.lib session alive across iterations
+        self._NE_geometry_model = "flat" #"flat" (one universe) or "lattice" (nested RectLattices)
+        self._NE_tally_backend = "cell" #"cell" (CellFilter) or "mesh" (17x17xNN RegularMesh on fuel)
+        self._NE_water_binning = False #Share water materials between voxels of close T and rho
+        self._NE_T_tolerance = 1.0 #Water bin width in K
+        self._NE_rho_tolerance = 1.0 #Water bin width in kg/m3
+        self._NE_warm_start = False #Start each NE run from the previous iteration's fission source
+        self._NE_warm_inactive = 5 #Inactive batches of a warm-started NE run
+        self._adaptive_schedule = False #Grow particles as the inter-iteration power change shrinks
+        self._min_particles = 1000 #Particles of the first scheduled iterations
+        self._NE_trigger_rel_err = None #Stop NE runs once heating_per_cell reaches this relative error
+        self.power_changes = []
+        self.confirm_convergence = False #Next NE run at full statistics to confirm convergence
+        self.picard = PicardController() #Residuals, relaxation and stopping tolerances
+        self.cache = StageCache()
+        self._memoize = True #Skip stages whose inputs and outputs are unchanged since the last run
+        self.stage_ran = True
+        self.stage_result = None
+        self._in_memory = False #Pass fields between stages in memory, files written in the background
+        self.previous_th = None
+        self.previous_power = None
+        self.post = PostProcessor(workers=1) #Background lane for plots, bounded queue
     
     @property
     def NN(self):
@@ -124,8 +162,328 @@ class MainCoupling:
             raise ValueError("restart_from_NE must True or False")
         self._restart_from_NE = value     
 
+    @property
+    def TH_workers(self):
+        return self._TH_workers
+    
+    @TH_workers.setter
+    def TH_workers(self, value):
+        if value < 0:
+            raise ValueError("TH_workers must be >= 0")
+        self._TH_workers = value
+
+    @property
+    def TH_parallel(self):
+        return self._TH_parallel
+    
+    @TH_parallel.setter
+    def TH_parallel(self, value):
+        if value != False and value !=True:
+            raise ValueError("TH_parallel must True or False")
+        self._TH_parallel = value
+
+    @property
+    def TH_nprocs(self):
+        return self._TH_nprocs
+    
+    @TH_nprocs.setter
+    def TH_nprocs(self, value):
+        if value < 0:
+            raise ValueError("TH_nprocs must be >= 0")
+        self._TH_nprocs = value
+
+    @property
+    def TH_warm_start(self):
+        return self._TH_warm_start
+    
+    @TH_warm_start.setter
+    def TH_warm_start(self, value):
+        if value != False and value !=True:
+            raise ValueError("TH_warm_start must True or False")
+        self._TH_warm_start = value
+
+    @property
+    def TH_warm_end_time(self):
+        return self._TH_warm_end_time
+    
+    @TH_warm_end_time.setter
+    def TH_warm_end_time(self, value):
+        if value <= 0:
+            raise ValueError("TH_warm_end_time must be > 0")
+        self._TH_warm_end_time = value
+
+    @property
+    def TH_residual_tolerances(self):
+        return self._TH_residual_tolerances
+    
+    @TH_residual_tolerances.setter
+    def TH_residual_tolerances(self, value):
+        if not isinstance(value, dict) or any(tol <= 0 for tol in value.values()):
+            raise ValueError("TH_residual_tolerances must be a dict of positive tolerances")
+        self._TH_residual_tolerances = value
+
+    @property
+    def TH_monitor_tolerances(self):
+        return self._TH_monitor_tolerances
+    
+    @TH_monitor_tolerances.setter
+    def TH_monitor_tolerances(self, value):
+        if not isinstance(value, dict) or any(tol <= 0 for tol in value.values()):
+            raise ValueError("TH_monitor_tolerances must be a dict of positive tolerances")
+        self._TH_monitor_tolerances = value
+
+    @property
+    def TH_stop_window(self):
+        return self._TH_stop_window
+    
+    @TH_stop_window.setter
+    def TH_stop_window(self, value):
+        if value < 1:
+            raise ValueError("TH_stop_window must be >= 1")
+        self._TH_stop_window = value
+
+    @property
+    def TH_link_template(self):
+        return self._TH_link_template
+    
+    @TH_link_template.setter
+    def TH_link_template(self, value):
+        if value != False and value !=True:
+            raise ValueError("TH_link_template must True or False")
+        self._TH_link_template = value
+
+    @property
+    def NE_persistent_session(self):
+        return self._NE_persistent_session
+    
+    @NE_persistent_session.setter
+    def NE_persistent_session(self, value):
+        if value != False and value !=True:
+            raise ValueError("NE_persistent_session must True or False")
+        self._NE_persistent_session = value
+
+    @property
+    def NE_geometry_model(self):
+        return self._NE_geometry_model
+    
+    @NE_geometry_model.setter
+    def NE_geometry_model(self, value):
+        if value not in ("flat", "lattice"):
+            raise ValueError("NE_geometry_model must be 'flat' or 'lattice'")
+        self._NE_geometry_model = value
+
+    @property
+    def NE_tally_backend(self):
+        return self._NE_tally_backend
+    
+    @NE_tally_backend.setter
+    def NE_tally_backend(self, value):
+        if value not in ("cell", "mesh"):
+            raise ValueError("NE_tally_backend must be 'cell' or 'mesh'")
+        self._NE_tally_backend = value
+
+    @property
+    def NE_water_binning(self):
+        return self._NE_water_binning
+    
+    @NE_water_binning.setter
+    def NE_water_binning(self, value):
+        if value != False and value !=True:
+            raise ValueError("NE_water_binning must True or False")
+        self._NE_water_binning = value
+
+    @property
+    def NE_T_tolerance(self):
+        return self._NE_T_tolerance
+    
+    @NE_T_tolerance.setter
+    def NE_T_tolerance(self, value):
+        if value <= 0:
+            raise ValueError("NE_T_tolerance must be > 0")
+        self._NE_T_tolerance = value
+
+    @property
+    def NE_rho_tolerance(self):
+        return self._NE_rho_tolerance
+    
+    @NE_rho_tolerance.setter
+    def NE_rho_tolerance(self, value):
+        if value <= 0:
+            raise ValueError("NE_rho_tolerance must be > 0")
+        self._NE_rho_tolerance = value
+
+    @property
+    def NE_warm_start(self):
+        return self._NE_warm_start
+    
+    @NE_warm_start.setter
+    def NE_warm_start(self, value):
+        if value != False and value !=True:
+            raise ValueError("NE_warm_start must True or False")
+        self._NE_warm_start = value
+
+    @property
+    def NE_warm_inactive(self):
+        return self._NE_warm_inactive
+    
+    @NE_warm_inactive.setter
+    def NE_warm_inactive(self, value):
+        if value < 0:
+            raise ValueError("NE_warm_inactive must be >= 0")
+        self._NE_warm_inactive = value
+
+    @property
+    def adaptive_schedule(self):
+        return self._adaptive_schedule
+    
+    @adaptive_schedule.setter
+    def adaptive_schedule(self, value):
+        if value != False and value !=True:
+            raise ValueError("adaptive_schedule must True or False")
+        self._adaptive_schedule = value
+
+    @property
+    def min_particles(self):
+        return self._min_particles
+    
+    @min_particles.setter
+    def min_particles(self, value):
+        if value <= 0:
+            raise ValueError("min_particles must be > 0")
+        self._min_particles = value
+
+    @property
+    def in_memory(self):
+        return self._in_memory
+    
+    @in_memory.setter
+    def in_memory(self, value):
+        if value != False and value !=True:
+            raise ValueError("in_memory must True or False")
+        self._in_memory = value
+
+    @property
+    def plot_every(self):
+        return self.post.plot_every
+    
+    @plot_every.setter
+    def plot_every(self, value):
+        if value <= 0:
+            raise ValueError("plot_every must be > 0")
+        self.post.plot_every = value
+
+    @property
+    def plot_workers(self):
+        return self.post.workers
+    
+    @plot_workers.setter
+    def plot_workers(self, value):
+        if value < 0:
+            raise ValueError("plot_workers must be >= 0")
+        self.post.workers = value
+
+    @property
+    def memoize(self):
+        return self._memoize
+    
+    @memoize.setter
+    def memoize(self, value):
+        if value != False and value !=True:
+            raise ValueError("memoize must True or False")
+        self._memoize = value
+
+    @property
+    def relaxation(self):
+        return self.picard.relaxation
+    
+    @relaxation.setter
+    def relaxation(self, value):
+        self.picard.relaxation = value
+
+    @property
+    def omega(self):
+        return self.picard.omega
+    
+    @omega.setter
+    def omega(self, value):
+        self.picard.omega = value
+
+    @property
+    def power_tolerance(self):
+        return self.picard.power_tolerance
+    
+    @power_tolerance.setter
+    def power_tolerance(self, value):
+        if value is not None and value <= 0:
+            raise ValueError("power_tolerance must be > 0 or None")
+        self.picard.power_tolerance = value
+
+    @property
+    def temperature_tolerance(self):
+        return self.picard.temperature_tolerance
+    
+    @temperature_tolerance.setter
+    def temperature_tolerance(self, value):
+        if value is not None and value <= 0:
+            raise ValueError("temperature_tolerance must be > 0 or None")
+        self.picard.temperature_tolerance = value
+
+    @property
+    def density_tolerance(self):
+        return self.picard.density_tolerance
+    
+    @density_tolerance.setter
+    def density_tolerance(self, value):
+        if value is not None and value <= 0:
+            raise ValueError("density_tolerance must be > 0 or None")
+        self.picard.density_tolerance = value
+
+    @property
+    def NE_trigger_rel_err(self):
+        return self._NE_trigger_rel_err
+    
+    @NE_trigger_rel_err.setter
+    def NE_trigger_rel_err(self, value):
+        if value is not None and value <= 0:
+            raise ValueError("NE_trigger_rel_err must be > 0 or None")
+        self._NE_trigger_rel_err = value
+
 
     def main(self):
+        NIG.persistent_session = self.NE_persistent_session
+        NIG.geometry_model = self.NE_geometry_model
+        NIG.tally_backend = self.NE_tally_backend
+        NIG.water_binning = self.NE_water_binning
+        NIG.T_tolerance = self.NE_T_tolerance
+        NIG.rho_tolerance = self.NE_rho_tolerance
+        NIG.warm_start = self.NE_warm_start
+        NIG.warm_inactive = self.NE_warm_inactive
+        NIG.trigger_rel_err = self.NE_trigger_rel_err
+        TIG.parallel = self.TH_parallel
+        TIG.nprocs = self.TH_nprocs
+        TIG.warm_start = self.TH_warm_start
+        TIG.warm_end_time = self.TH_warm_end_time
+        TIG.residual_tolerances = self.TH_residual_tolerances
+        TIG.monitor_tolerances = self.TH_monitor_tolerances
+        TIG.stop_window = self.TH_stop_window
+        TIG.link_template = self.TH_link_template
+        TOR.async_write = self.in_memory
+        NOR.async_write = self.in_memory
+        self.power_changes = []
+        self.confirm_convergence = False
+        self.picard.reset()
+        self.previous_th = None
+        self.previous_power = None
+        self.post.start()
+        TOR.post = NOR.post = NIG.post = self.post
+        try:
+            self.coupling_loop()
+        finally:
+            NIG.session_close()
+            FieldExchange().flush()
+            self.post.close()
+
+    def coupling_loop(self):
         if self.restart_from_NE:
             iteration = int(self.start_iteration-1)
             NIG.NN = self.NN
@@ -134,14 +492,14 @@ class MainCoupling:
             NIG.particles = self.particles
             NIG.casename = self.casename
             NIG.iteration = iteration
-            NIG.main()
+            nig_key = self.run_stage("NIG", iteration, NIG.main, *self.NIG_inputs(iteration))
 
             NOR.NN = self.NN
             NOR.P_target = self.P_target
             NOR.batches = self.batches
             NOR.casename = self.casename
             NOR.iteration = iteration
-            NOR.main()
+            self.run_stage("NOR", iteration, NOR.main, [], self.NOR_params(nig_key), [NOR.output_dir])
 
 
         for iteration in range(self.start_iteration, self.last_iteration):
@@ -151,20 +509,202 @@ class MainCoupling:
             TOR.casename = self.casename
             TIG.iteration = iteration
             TOR.iteration = iteration
-            TIG.main()
-            TOR.main()
+            TOR.mc_workers = self.TH_workers
+            FieldExchange().flush() #NE_output.csv est lu par fvOptions
+            tig_key = self.run_stage("TIG", iteration, TIG.main,
+                                     [TIG.template_dir, self.exchange_path(iteration, "NE_output.csv") if iteration != 0 else None],
+                                     self.TIG_params(iteration), [TIG.results_dir])
+            self.run_stage("TOR", iteration, TOR.main, [], self.TOR_params(tig_key), [TOR.output_dir])
+            th_data = self.stage_result if self.in_memory and self.stage_ran else None
+            self.th_residuals(iteration, th_data)
 
             NIG.NN = self.NN
             NIG.batches = self.batches
             NIG.inactive = self.inactive
-            NIG.particles = self.particles
+            NIG.particles = self.schedule_particles(iteration)
             NIG.casename = self.casename
             NIG.iteration = iteration
-            NIG.main()
+            water_data = ThField.from_columns(th_data) if th_data is not None else None
+            nig_key = self.run_stage("NIG", iteration, lambda: NIG.main(water_data), *self.NIG_inputs(iteration, th_data))
 
             NOR.NN = self.NN
             NOR.P_target = self.P_target
             NOR.batches = self.batches
             NOR.casename = self.casename
             NOR.iteration = iteration
-            NOR.main()
\ No newline at end of file
+            self.run_stage("NOR", iteration, lambda: self.relax_power(iteration, NOR.main()),
+                           [], self.NOR_params(nig_key), self.NOR_outputs(iteration))
+            if not self.stage_ran:
+                self.previous_power = None
+                self.power_residuals(iteration)
+                self.restore_relaxation(iteration)
+
+            self.picard.end_iteration(iteration, os.path.join(os.getcwd(), "Results", self.casename, "residuals.csv"))
+            if self.picard.converged():
+                if NIG.particles < self.particles:
+                    # Puissance finale jamais issue d'un calcul NE à statistique réduite
+                    print(f"Critères atteints à l'itération {iteration} avec {NIG.particles} particules, "
+                          f"itération de confirmation à {self.particles} particules")
+                    self.confirm_convergence = True
+                    continue
+                print(f"Couplage convergé à l'itération {iteration}")
+                break
+
+    # Mémoïsation : chaque étape enregistre l'empreinte de ses entrées dans Results/<cas>/<itération>/.<étape>.stamp.
+    # Les étapes aval chaînent l'empreinte amont au lieu de relire les gros dossiers de résultats.
+
+    def run_stage(self, name, iteration, run, inputs, params, outputs):
+
+        key = self.cache.key(inputs, {"stage": name, **params})
+        stamp = self.exchange_path(iteration, f".{name}.stamp")
+        self.stage_ran = not (self.memoize and self.cache.done(stamp, key, outputs))
+        if not self.stage_ran:
+            print(f"{name} itération {iteration} : entrées inchangées, étape sautée")
+            return key
+        self.stage_result = run()
+        self.cache.record(stamp, key)
+        return key
+
+    def TIG_params(self, iteration):
+        # Démarrage à chaud : le 0/ initial vient du calcul TH précédent, dont l'empreinte est chaînée
+        # (à défaut de stamp, empreinte du champ TH qu'il a produit)
+        previous = None
+        if TIG.warm_start and iteration != 0:
+            previous = self.cache.recorded(self.exchange_path(iteration-1, ".TIG.stamp")) or \
+                       self.cache.path_hash(self.exchange_path(iteration-1, "TH_output.bin"))
+        return {"warm_start": TIG.warm_start, "warm_end_time": TIG.warm_end_time,
+                "residual_tolerances": TIG.residual_tolerances,
+                "monitor_tolerances": TIG.monitor_tolerances, "stop_window": TIG.stop_window,
+                "previous_TIG": previous}
+
+    def TOR_params(self, tig_key):
+
+        return {"TIG": tig_key, "mc_samples_per_voxel": TOR.mc_samples_per_voxel, "seed": TOR.seed,
+                "remap_method": TOR.remap_method, "mc_workers": TOR.mc_workers,
+                "grid": (TOR.nx, TOR.ny, TOR.nz),
+                "bounds": (TOR.xmin, TOR.xmax, TOR.ymin, TOR.ymax, TOR.zmin, TOR.zmax),
+                "native_reader": TOR.native_reader, "use_weights_cache": TOR.use_weights_cache}
+
+    def NIG_inputs(self, iteration, th_data=None):
+        # Champ TH en mémoire ou fichier : même empreinte (StageCache.columns_hash)
+        inputs = [th_data if th_data is not None else NIG.output_dir, NIG.previous_source if NIG.warm_start else None]
+        params = {name: getattr(NIG, name) for name in
+                  ("NN", "batches", "inactive", "particles", "geometry_model", "tally_backend",
+                   "water_binning", "T_tolerance", "rho_tolerance", "temperature_margin",
+                   "warm_start", "warm_inactive", "trigger_rel_err")}
+        return inputs, params, [NIG.results_dir, NIG.statepoint_path]
+
+    def NOR_params(self, nig_key):
+
+        return {"NIG": nig_key, "NN": NOR.NN, "P_target": NOR.P_target,
+                "relaxation": self.picard.relaxation, "omega": self.picard.omega}
+
+    def NOR_outputs(self, iteration):
+        # Avec Aitken, l'omega appliqué fait partie des sorties : sans lui la reprise diverge
+        if self.picard.relaxation == "aitken":
+            return [NOR.output_dir, self.exchange_path(iteration+1, "relaxation.bin")]
+        return [NOR.output_dir]
+
+    def exchange_path(self, iteration, name):
+        return os.path.join(os.getcwd(), "Results", self.casename, str(iteration), name)
+
+    def th_residuals(self, iteration, th_data):
+        # Résidus T et rho en mémoire si les deux champs y sont, sinon depuis les fichiers
+        if th_data is not None and self.previous_th is not None:
+            for name in ("T", "rho"):
+                self.picard.residuals(name, th_data[name], self.previous_th[name])
+        else:
+            FieldExchange().flush()
+            self.picard.field_residuals(self.exchange_path(iteration, "TH_output.bin"),
+                                        self.exchange_path(iteration-1, "TH_output.bin"), ["T", "rho"])
+        self.previous_th = th_data
+
+    def relax_power(self, iteration, data=None):
+        # Résidu sur la puissance brute de NOR et réécriture de la puissance relaxée pour le TH
+        path = self.exchange_path(iteration+1, "NE_output.bin")
+        raw_path = self.exchange_path(iteration+1, "NE_output_raw.bin")
+        omega_path = self.exchange_path(iteration+1, "relaxation.bin")
+        previous_path = self.exchange_path(iteration, "NE_output.bin")
+        if data is None or self.previous_power is None:
+            FieldExchange().flush()
+        if data is None:
+            data = FieldExchange().read(path)
+        data = {name: np.array(values) for name, values in data.items()}
+        previous = self.previous_power
+        if previous is None and os.path.exists(previous_path):
+            previous = np.asarray(FieldExchange().read(previous_path, ["Power"])["Power"])
+
+        if previous is not None:
+            self.picard.residuals("Power", data["Power"], previous)
+        relaxed = self.picard.relax(data["Power"], previous)
+        self.previous_power = relaxed
+        if self.picard.relaxation == "none":
+            for stale_path in (raw_path, omega_path):
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            return
+
+        csv_path = NOR.csv_output_dir if NOR.write_csv else None
+        relaxed_data = {**data, "Power": relaxed}
+        omega = {"omega": np.array([self.picard.row["omega"]], dtype=np.float64)}
+        if self.in_memory:
+            FieldExchange().write_async(raw_path, data)
+            FieldExchange().write_async(omega_path, omega)
+            FieldExchange().write_async(path, relaxed_data, csv_path)
+        else:
+            FieldExchange().write(raw_path, data)
+            FieldExchange().write(omega_path, omega)
+            FieldExchange().write(path, relaxed_data)
+            if csv_path is not None:
+                FieldExchange().write_csv(csv_path, relaxed_data)
+
+    def restore_relaxation(self, iteration):
+        # Étape NOR sautée : état Aitken relu (puissance brute de it+1, puissance relaxée de it, omega)
+        # pour que l'itération recalculée suivante relaxe comme dans un calcul ininterrompu
+        if self.picard.relaxation != "aitken":
+            return
+        FieldExchange().flush()
+        raw_path = self.exchange_path(iteration+1, "NE_output_raw.bin")
+        previous_path = self.exchange_path(iteration, "NE_output.bin")
+        omega_path = self.exchange_path(iteration+1, "relaxation.bin")
+        if not all(os.path.exists(p) for p in (raw_path, previous_path, omega_path)):
+            return #Première itération : relax() n'avait pas d'état à enregistrer
+        self.picard.restore(FieldExchange().read(raw_path, ["Power"])["Power"],
+                            FieldExchange().read(previous_path, ["Power"])["Power"],
+                            FieldExchange().read(omega_path)["omega"][0])
+
+    def power_residuals(self, iteration):
+        # Étape NOR sautée : résidu recalculé depuis les fichiers (puissance brute si relaxée)
+        FieldExchange().flush()
+        raw_path = self.exchange_path(iteration+1, "NE_output_raw.bin")
+        path = raw_path if os.path.exists(raw_path) else self.exchange_path(iteration+1, "NE_output.bin")
+        self.picard.field_residuals(path, self.exchange_path(iteration, "NE_output.bin"), ["Power"])
+
+    def power_change(self, iteration):
+        # Variation relative (norme L2) entre les puissances NE_output de iteration et iteration-1
+        FieldExchange().flush()
+        paths = [os.path.join(os.getcwd(), "Results", self.casename, str(i), "NE_output.bin") for i in (iteration, iteration-1)]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        new, old = (np.asarray(FieldExchange().read(path, ["Power"])["Power"]) for path in paths)
+        return np.linalg.norm(new - old) / np.linalg.norm(new)
+
+    def schedule_particles(self, iteration):
+        # Bruit statistique ~ 1/sqrt(N) : N croît comme (variation initiale / variation courante)^2.
+        # Dernière itération et itération de confirmation de la convergence toujours à pleine statistique.
+        if not self.adaptive_schedule:
+            return self.particles
+        change = self.power_change(iteration)
+        if change is not None:
+            self.power_changes.append(change)
+        if self.confirm_convergence or iteration >= self.last_iteration - 1:
+            self.confirm_convergence = False
+            return self.particles
+        min_particles = min(self.min_particles, self.particles)
+        if len(self.power_changes) < 2:
+            particles = min_particles
+        else:
+            ratio = (self.power_changes[0] / max(self.power_changes[-1], 1e-12)) ** 2
+            particles = int(min(max(min_particles * ratio, min_particles), self.particles))
+        print(f"Particules de l'itération {iteration} : {particles}")
+        return particles
\ No newline at end of file
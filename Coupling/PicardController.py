@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from Coupling.FieldExchange import FieldExchange
+
+__all__ = ["PicardController"]
+
+class PicardController:
+
+    # Contrôle de la boucle de Picard : résidus entre itérations, relaxation de la puissance
+    # transmise au TH (constante ou Aitken) et critère d'arrêt sur les tolérances
+
+    def __init__(self):
+
+        self._relaxation = "none" #"none", "constant" ou "aitken"
+        self._omega = 1.0 #Facteur de relaxation (initial pour Aitken)
+        self.omega_min = 0.1
+        self.omega_max = 1.0
+        self.power_tolerance = None #Résidu L2 relatif sur la puissance
+        self.temperature_tolerance = None #Résidu Linf sur T (K)
+        self.density_tolerance = None #Résidu Linf sur rho (kg/m3)
+        self.reset()
+
+    @property
+    def relaxation(self):
+        return self._relaxation
+
+    @relaxation.setter
+    def relaxation(self, value):
+        if value not in ("none", "constant", "aitken"):
+            raise ValueError("relaxation must be 'none', 'constant' or 'aitken'")
+        self._relaxation = value
+
+    @property
+    def omega(self):
+        return self._omega
+
+    @omega.setter
+    def omega(self, value):
+        if value <= 0 or value > 1:
+            raise ValueError("omega must be in ]0, 1]")
+        self._omega = value
+
+    def reset(self):
+
+        self.history = []
+        self.row = {}
+        self._last_omega = None
+        self._last_residual = None
+
+    def residuals(self, name, new, old):
+        # Norme L2 relative et Linf absolue, voxels non définis (NaN) ignorés
+        new = np.asarray(new, dtype=np.float64)
+        old = np.asarray(old, dtype=np.float64)
+        mask = np.isfinite(new) & np.isfinite(old)
+        diff = new[mask] - old[mask]
+        norm = np.linalg.norm(new[mask])
+        self.row[f"{name}_L2"] = np.linalg.norm(diff) / norm if norm > 0 else 0.0
+        self.row[f"{name}_Linf"] = np.abs(diff).max() if diff.size else 0.0
+
+    def field_residuals(self, path, previous_path, names):
+        # Résidus des colonnes names entre deux fichiers d'échange (mêmes lignes)
+        if not (os.path.exists(path) and os.path.exists(previous_path)):
+            return
+        new = FieldExchange().read(path, names)
+        old = FieldExchange().read(previous_path, names)
+        for name in names:
+            self.residuals(name, new[name], old[name])
+
+    def relax(self, new, old):
+        # Puissance transmise au TH : old + omega * (new - old)
+        new = np.asarray(new, dtype=np.float64)
+        if old is None or self.relaxation == "none":
+            self.row["omega"] = 1.0
+            return new
+        old = np.asarray(old, dtype=np.float64)
+        residual = new - old
+
+        omega = self.omega
+        if self.relaxation == "aitken" and self._last_residual is not None:
+            delta = residual - self._last_residual
+            denom = delta @ delta
+            if denom > 0:
+                omega = -self._last_omega * (self._last_residual @ delta) / denom
+                omega = min(max(omega, self.omega_min), self.omega_max)
+            else:
+                omega = self._last_omega
+
+        self._last_omega = omega
+        self._last_residual = residual
+        self.row["omega"] = omega
+        return old + omega * residual
+
+    def restore(self, new, old, omega):
+        # Reprise sans relax() : état Aitken d'une itération déjà calculée (résidu new - old, omega appliqué)
+        self._last_residual = np.asarray(new, dtype=np.float64) - np.asarray(old, dtype=np.float64)
+        self._last_omega = float(omega)
+
+    def end_iteration(self, iteration, path):
+        # Ajoute la ligne de l'itération à l'historique et réécrit le fichier des résidus
+        self.history.append({"iteration": iteration, **self.row})
+        self.row = {}
+        names = sorted({key for row in self.history for key in row} - {"iteration"})
+        columns = {"iteration": np.array([row["iteration"] for row in self.history])}
+        for name in names:
+            columns[name] = np.array([row.get(name, np.nan) for row in self.history], dtype=np.float64)
+        FieldExchange().write_csv(path, columns, float_format="%.6e")
+
+    def converged(self):
+
+        if not self.history:
+            return False
+        last = self.history[-1]
+        checks = [("Power_L2", self.power_tolerance), ("T_Linf", self.temperature_tolerance),
+                  ("rho_Linf", self.density_tolerance)]
+        checks = [(name, tol) for name, tol in checks if tol is not None]
+        if not checks:
+            return False
+        return all(name in last and last[name] <= tol for name, tol in checks)
@@ -0,0 +1,72 @@
+import queue
+import threading
+
+__all__ = ["PostProcessor"]
+
+class PostProcessor:
+
+    # File de post-traitement (figures, diagnostics) hors du chemin critique des solveurs.
+    # workers = 0 : exécution immédiate dans l'appelant (scripts lancés seuls).
+    # File bornée : une tâche qui ne trouve pas de place est abandonnée, jamais attendue.
+
+    def __init__(self, workers=0, max_queue=4, plot_every=1):
+
+        self.workers = workers
+        self.max_queue = max_queue
+        self.plot_every = plot_every #Post-traitement des itérations multiples de plot_every
+        self._queue = None
+        self._threads = []
+
+    def start(self):
+
+        if self.workers <= 0 or self._queue is not None:
+            return
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                fn, args = task
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ Post-traitement {fn.__name__} en échec : {e}")
+            finally:
+                self._queue.task_done()
+
+    def due(self, iteration):
+
+        return int(iteration) % self.plot_every == 0
+
+    def submit(self, fn, *args, iteration=None):
+
+        if iteration is not None and not self.due(iteration):
+            return False
+        if self._queue is None:
+            fn(*args)
+            return True
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            print(f"⚠️ File de post-traitement pleine, {fn.__name__} ignoré")
+            return False
+        return True
+
+    def close(self):
+        # Attend les tâches en cours puis arrête les threads
+        if self._queue is None:
+            return
+        self._queue.join()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._queue = None
+        self._threads = []
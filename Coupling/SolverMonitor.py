@@ -0,0 +1,75 @@
+import re
+import numpy as np
+from Coupling.FieldExchange import FieldExchange
+
+__all__ = ["SolverMonitor"]
+
+class SolverMonitor:
+
+    # Suivi du journal d'un solveur OpenFOAM ligne par ligne : résidus initiaux par champ et
+    # grandeurs surveillées (fonctions surfaceFieldValue avec log true, ex. T moyenne en sortie).
+    # Convergence : tolérances respectées sur toute une fenêtre de pas de temps.
+
+    TIME = re.compile(r"^Time = (\S+)")
+    RESIDUAL = re.compile(r"Solving for (\w+), Initial residual = ([^,\s]+)")
+    VALUE = re.compile(r"^\s*\w+\((\w+)\) of (\w+) = (\S+)")
+
+    def __init__(self, residual_tolerances=None, monitor_tolerances=None, window=20):
+
+        self.residual_tolerances = residual_tolerances or {} #Champ -> résidu initial maximal
+        self.monitor_tolerances = monitor_tolerances or {} #"T_outlet" -> variation maximale sur la fenêtre
+        self.window = window
+        self.history = []
+        self._row = None
+
+    def feed(self, line):
+        # Renvoie True quand un pas de temps complet vient d'être ajouté à l'historique
+        match = self.TIME.match(line)
+        if match:
+            finished = self._close_row()
+            self._row = {"time": float(match.group(1))}
+            return finished
+        if self._row is None:
+            return False
+        match = self.RESIDUAL.search(line)
+        if match:
+            # Premier solveur du pas uniquement (p_rgh est résolu à chaque correcteur)
+            self._row.setdefault(match.group(1), float(match.group(2)))
+            return False
+        match = self.VALUE.match(line)
+        if match:
+            self._row[f"{match.group(2)}_{match.group(1)}"] = float(match.group(3))
+        return False
+
+    def _close_row(self):
+
+        if self._row is None:
+            return False
+        self.history.append(self._row)
+        self._row = None
+        return True
+
+    def converged(self):
+
+        if not (self.residual_tolerances or self.monitor_tolerances) or len(self.history) < self.window:
+            return False
+        rows = self.history[-self.window:]
+        for name, tol in self.residual_tolerances.items():
+            if not all(name in row and row[name] <= tol for row in rows):
+                return False
+        for name, tol in self.monitor_tolerances.items():
+            values = [row[name] for row in rows if name in row]
+            if len(values) < self.window or max(values) - min(values) > tol:
+                return False
+        return True
+
+    def write(self, path):
+        # Historique (une ligne par pas de temps) au format d'échange, champs absents = NaN
+        self._close_row()
+        if not self.history:
+            return
+        names = sorted({key for row in self.history for key in row} - {"time"})
+        columns = {"time": np.array([row["time"] for row in self.history], dtype=np.float64)}
+        for name in names:
+            columns[name] = np.array([row.get(name, np.nan) for row in self.history], dtype=np.float64)
+        FieldExchange().write(path, columns)
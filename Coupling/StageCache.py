@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import numpy as np
+from Coupling.FieldExchange import FieldExchange
+
+__all__ = ["StageCache"]
+
+class StageCache:
+
+    # Mémoïsation des étapes du couplage : une empreinte SHA-256 des entrées (fichiers, dossiers,
+    # paramètres) est enregistrée à côté des sorties. Une étape dont l'empreinte et les sorties
+    # sont déjà présentes n'est pas relancée.
+
+    def __init__(self):
+
+        self._file_hashes = {} #(chemin, taille, mtime) -> empreinte, évite de relire les gabarits
+
+    def file_hash(self, path):
+
+        stat = os.stat(path)
+        memo_key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = self._file_hashes.get(memo_key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            self._file_hashes[memo_key] = digest
+        return digest
+
+    def columns_hash(self, columns):
+        # Champ d'échange : même empreinte qu'il soit en mémoire ou lu depuis son fichier .bin
+        h = hashlib.sha256()
+        for name in sorted(columns):
+            values = np.ascontiguousarray(columns[name])
+            h.update(name.encode())
+            h.update(values.dtype.newbyteorder("<").str.encode())
+            h.update(values.astype(values.dtype.newbyteorder("<"), copy=False).tobytes())
+        return h.hexdigest()
+
+    def path_hash(self, path):
+        # Colonnes en mémoire, fichier d'échange .bin, fichier, dossier (contenu récursif trié) ou entrée absente
+        if isinstance(path, dict):
+            return self.columns_hash(path)
+        if path is None or not os.path.exists(path):
+            return None
+        if path.endswith(".bin"):
+            return self.columns_hash(FieldExchange().read(path))
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                h.update(os.path.relpath(full, path).encode())
+                h.update(self.file_hash(full).encode())
+        return h.hexdigest()
+
+    def key(self, inputs, params):
+
+        payload = {"inputs": [self.path_hash(path) for path in inputs], "params": params}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def recorded(self, stamp_path):
+
+        if not os.path.exists(stamp_path):
+            return None
+        with open(stamp_path) as f:
+            return json.load(f).get("key")
+
+    def done(self, stamp_path, key, outputs):
+
+        return self.recorded(stamp_path) == key and all(path is not None and os.path.exists(path) for path in outputs)
+
+    def record(self, stamp_path, key):
+
+        os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+        tmp_path = stamp_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key": key}, f)
+        os.replace(tmp_path, stamp_path)
@@ -0,0 +1,46 @@
+import numpy as np
+from Coupling.FieldExchange import FieldExchange
+
+__all__ = ["ThField"]
+
+class ThField:
+
+    # Champ TH voxelisé : tableaux contigus (nz, ny, nx), indices 1-based (ix, iy, iz) côté appelant
+
+    def __init__(self, T, rho, valid=None):
+
+        self.T = np.ascontiguousarray(T, dtype=np.float64)
+        self.rho = np.ascontiguousarray(rho, dtype=np.float64)
+        self.valid = None if valid is None else np.ascontiguousarray(valid)
+        if self.T.ndim != 3 or self.rho.shape != self.T.shape:
+            raise ValueError("T and rho must be (nz, ny, nx) arrays of the same shape")
+
+    @classmethod
+    def from_columns(cls, columns):
+        # Colonnes ix, iy, iz, T, rho (+ valid ou covered) dans un ordre quelconque
+        ix = np.asarray(columns["ix"], dtype=np.int64) - 1
+        iy = np.asarray(columns["iy"], dtype=np.int64) - 1
+        iz = np.asarray(columns["iz"], dtype=np.int64) - 1
+        shape = (iz.max() + 1, iy.max() + 1, ix.max() + 1)
+
+        def grid(values, fill):
+            arr = np.full(shape, fill, dtype=np.asarray(values).dtype)
+            arr[iz, iy, ix] = values
+            return arr
+
+        valid = columns.get("valid", columns.get("covered"))
+        return cls(grid(columns["T"], np.nan), grid(columns["rho"], np.nan),
+                   None if valid is None else grid(valid, 0))
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_columns(FieldExchange().read(path))
+
+    @property
+    def nz(self):
+        return self.T.shape[0]
+
+    def axial_mean(self, name="T", nx=None, ny=None):
+        # Moyenne par nœud axial sur les nx x ny premiers voxels (tout le plan par défaut)
+        values = getattr(self, name)[:, :ny, :nx]
+        return values.reshape(self.nz, -1).mean(axis=1)
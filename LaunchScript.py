@@ -11,6 +11,35 @@ casename = "Test1"
 start_iteration = 1
 last_iteration = 20
 restart_from_NE = False
+TH_workers = 0
+TH_parallel = False
+TH_nprocs = 0
+TH_warm_start = False
+TH_warm_end_time = 500
+TH_residual_tolerances = {}
+TH_monitor_tolerances = {}
+TH_stop_window = 20
+TH_link_template = True
+NE_persistent_session = False
+NE_geometry_model = "flat"
+NE_tally_backend = "cell"
+NE_water_binning = False
+NE_T_tolerance = 1.0
+NE_rho_tolerance = 1.0
+NE_warm_start = False
+NE_warm_inactive = 5
+adaptive_schedule = False
+min_particles = 1000
+NE_trigger_rel_err = None
+relaxation = "none"
+omega = 1.0
+power_tolerance = None
+temperature_tolerance = None
+density_tolerance = None
+memoize = True
+in_memory = False
+plot_every = 1
+plot_workers = 1
 
 MCG.NN = NN
 MCG.batches = batches
@@ -21,6 +50,35 @@ MCG.casename = casename
 MCG.last_iteration = last_iteration
 MCG.start_iteration = start_iteration
 MCG.restart_from_NE = restart_from_NE
+MCG.TH_workers = TH_workers
+MCG.TH_parallel = TH_parallel
+MCG.TH_nprocs = TH_nprocs
+MCG.TH_warm_start = TH_warm_start
+MCG.TH_warm_end_time = TH_warm_end_time
+MCG.TH_residual_tolerances = TH_residual_tolerances
+MCG.TH_monitor_tolerances = TH_monitor_tolerances
+MCG.TH_stop_window = TH_stop_window
+MCG.TH_link_template = TH_link_template
+MCG.NE_persistent_session = NE_persistent_session
+MCG.NE_geometry_model = NE_geometry_model
+MCG.NE_tally_backend = NE_tally_backend
+MCG.NE_water_binning = NE_water_binning
+MCG.NE_T_tolerance = NE_T_tolerance
+MCG.NE_rho_tolerance = NE_rho_tolerance
+MCG.NE_warm_start = NE_warm_start
+MCG.NE_warm_inactive = NE_warm_inactive
+MCG.adaptive_schedule = adaptive_schedule
+MCG.min_particles = min_particles
+MCG.NE_trigger_rel_err = NE_trigger_rel_err
+MCG.relaxation = relaxation
+MCG.omega = omega
+MCG.power_tolerance = power_tolerance
+MCG.temperature_tolerance = temperature_tolerance
+MCG.density_tolerance = density_tolerance
+MCG.memoize = memoize
+MCG.in_memory = in_memory
+MCG.plot_every = plot_every
+MCG.plot_workers = plot_workers
 
 MCG.main()
 
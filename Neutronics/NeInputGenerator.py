@@ -1,10 +1,18 @@
 import openmc
 from openmc import lib
+import numpy as np
+import h5py
+import re
 import os
+import glob
+import itertools
+import hashlib
 import time
 import sys
 from PIL import Image
-import pandas as pd
+from Coupling.ThField import ThField
+from Coupling.FieldExchange import FieldExchange
+from Coupling.PostProcessor import PostProcessor
 
 __all__ = ["NeInputGenerator"]
 
@@ -51,10 +59,35 @@ class NeInputGenerator:
         self._particles = 0
         self._iteration = 0
         self._casename = "default"
+        self._geometry_model = "flat"
+        self._tally_backend = "cell" #"cell" (CellFilter sur tally_cells) ou "mesh" (RegularMesh 17x17xNN)
+        self.water_binning = False #Regroupement des voxels d'eau en matériaux partagés
+        self._T_tolerance = 1.0 #Largeur d'un groupe en température (K)
+        self._rho_tolerance = 1.0 #Largeur d'un groupe en densité (kg/m3)
+        self.water_bins = None
+        self.water_material_ids = None #IDs des matériaux d'eau par voxel (NN, 34, 34)
+        self.water_cell_ids = None #IDs des cellules d'eau par voxel (NN, 34, 34)
+        self._temperature_margin = 50.0 #Marge autour des températures du modèle (K)
+        self.temperature_range = None
+        self.warm_start = False #Source initiale = source de fission de l'itération précédente
+        self._warm_inactive = 5 #Batches inactifs d'une itération démarrée à chaud
+        self._entropy_tolerance = 0.01 #Écart relatif d'entropie de Shannon toléré
+        self.warm_started = False
+        self._trigger_rel_err = None #Erreur relative visée sur heating_per_cell (None = pas de trigger)
+        self._trigger_min_active = 10 #Batches actifs minimum avant le test des triggers
+        self.threads = 12
+        self.persistent_session = False #Session openmc.lib gardée ouverte entre itérations
+        self.post = PostProcessor() #Tracés exécutés sur place sauf si MainCoupling fournit sa file
+        self.plotted_geometry = None #Empreinte du dernier geometry.xml tracé
+        self._session_open = False
 
         #Materials and Geometry
         self.cells = []
         self.tally_cells = []
+        self.tally_index = []
+        self.surfaces = {}
+        self.material_ids = None #Compteurs d'IDs, réinitialisés à chaque construction
+        self.cell_ids = None
         self.control_rod_list = [40, 43, 46, 55, 65, 88, 91, 94, 97, 100, 139, 142, 148, 151, 190, 193, 196, 199, 202, 225, 235, 244, 247, 250]
         self.instrument_tube_list = [145]
 
@@ -115,16 +148,123 @@ class NeInputGenerator:
     def casename(self, value):
         self._casename = value
 
+    @property
+    def geometry_model(self):
+        return self._geometry_model
+
+    @geometry_model.setter
+    def geometry_model(self, value):
+        if value not in ("flat", "lattice"):
+            raise ValueError("geometry_model must be 'flat' or 'lattice'")
+        self._geometry_model = value
+
+    @property
+    def tally_backend(self):
+        return self._tally_backend
+
+    @tally_backend.setter
+    def tally_backend(self, value):
+        if value not in ("cell", "mesh"):
+            raise ValueError("tally_backend must be 'cell' or 'mesh'")
+        self._tally_backend = value
+
+    @property
+    def T_tolerance(self):
+        return self._T_tolerance
+
+    @T_tolerance.setter
+    def T_tolerance(self, value):
+        if value <= 0:
+            raise ValueError("T_tolerance must be > 0")
+        self._T_tolerance = value
+
+    @property
+    def rho_tolerance(self):
+        return self._rho_tolerance
+
+    @rho_tolerance.setter
+    def rho_tolerance(self, value):
+        if value <= 0:
+            raise ValueError("rho_tolerance must be > 0")
+        self._rho_tolerance = value
+
+    @property
+    def temperature_margin(self):
+        return self._temperature_margin
+
+    @temperature_margin.setter
+    def temperature_margin(self, value):
+        if value < 0:
+            raise ValueError("temperature_margin must be >= 0")
+        self._temperature_margin = value
+
+    @property
+    def warm_inactive(self):
+        return self._warm_inactive
+
+    @warm_inactive.setter
+    def warm_inactive(self, value):
+        if value < 0:
+            raise ValueError("warm_inactive must be >= 0")
+        self._warm_inactive = value
+
+    @property
+    def entropy_tolerance(self):
+        return self._entropy_tolerance
+
+    @entropy_tolerance.setter
+    def entropy_tolerance(self, value):
+        if value <= 0:
+            raise ValueError("entropy_tolerance must be > 0")
+        self._entropy_tolerance = value
+
+    @property
+    def trigger_rel_err(self):
+        return self._trigger_rel_err
+
+    @trigger_rel_err.setter
+    def trigger_rel_err(self, value):
+        if value is not None and value <= 0:
+            raise ValueError("trigger_rel_err must be > 0 or None")
+        self._trigger_rel_err = value
+
+    @property
+    def trigger_min_active(self):
+        return self._trigger_min_active
+
+    @trigger_min_active.setter
+    def trigger_min_active(self, value):
+        if value <= 0:
+            raise ValueError("trigger_min_active must be > 0")
+        self._trigger_min_active = value
+
+    @property
+    def statepoint_path(self):
+        # Avec les triggers, le numéro du dernier batch n'est connu qu'après la simulation
+        statepoints = glob.glob(os.path.join(self.results_dir, "statepoint.*.h5"))
+        if not statepoints:
+            return None
+        return max(statepoints, key=lambda path: int(os.path.basename(path).split(".")[1]))
+
+    @property
+    def previous_source(self):
+        # Dernier fichier source.<n>.h5 de l'itération précédente, None s'il n'existe pas
+        previous_dir = os.path.join(os.getcwd(), "Results", self.casename, str(int(self.iteration)-1), "Neutronics")
+        sources = glob.glob(os.path.join(previous_dir, "source.*.h5"))
+        if not sources:
+            return None
+        return max(sources, key=lambda path: int(os.path.basename(path).split(".")[1]))
+
     @property
     def results_dir(self):
         return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "Neutronics")
 
     @property
     def output_dir(self):
-        return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "TH_output.csv")
+        return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "TH_output.bin")
 
 
-    def main(self):
+    def main(self, water_data=None):
         start = time.time()
         results_dir = self.results_dir
         output_dir = self.output_dir
@@ -132,26 +272,34 @@ class NeInputGenerator:
         print("Simulation NE en cours...")
 
         os.makedirs(results_dir, exist_ok=True)
-        water_data = self.TH_extract_data(output_dir)
-        self.geometry_creation(water_data)
-        self.tallies_creation()
-        self.settings_creation()
-        self.geometry_plot()
-        self.simulation_runner()
+        if water_data is None:
+            water_data = self.TH_extract_data(output_dir)
+
+        if self._session_open and not self.temperature_covered(water_data):
+            print("Températures hors de la plage chargée, réinitialisation de la session OpenMC")
+            self.session_close()
+
+        if self._session_open:
+            self.session_update(water_data)
+            self.session_run()
+        else:
+            self.geometry_creation(water_data)
+            self.tallies_creation()
+            self.settings_creation()
+            self.xs_memory_report()
+            self.geometry_plot()
+            if self.persistent_session:
+                self.session_init()
+                self.session_run()
+            else:
+                self.simulation_runner()
 
         end = time.time()
         print(f"Simulation NE terminée en {round(end-start, 0)}s")
 
     def TH_extract_data(self, output_dir):
 
-        water_data = {}
-        datas = pd.read_csv(output_dir, usecols=["ix", "iy", "iz", "T", "rho", "valid"])
-
-        for _, row in datas.iterrows():
-            x , y, z = row["ix"], row["iy"], row["iz"]
-            water_data.setdefault(x, {}).setdefault(y, {})[z] = {col: row[col] for col in datas.columns if col not in ("x", "y", "z")}
-
-        return water_data
+        return ThField.load(output_dir)
 
     def geometry_creation(self, water_data):
 
@@ -182,26 +330,57 @@ class NeInputGenerator:
         NN = self.NN 
         NH = self.AH/self._NN #Height of a node
 
+        self.cells = []
+        self.tally_cells = []
+        self.tally_index = []
+        self.surfaces = {}
+        # IDs attribués par compteur : la correspondance avec (x, y, z) est dans tally_map.bin
+        # et dans water_material_ids / water_cell_ids, jamais dans la valeur de l'ID
+        openmc.reset_auto_ids()
+        self.material_ids = itertools.count(water_material_id)
+        self.cell_ids = itertools.count(1)
+        self.water_material_ids = np.zeros((NN, 34, 34), dtype=np.int64)
+        self.water_cell_ids = np.zeros((NN, 34, 34), dtype=np.int64)
         cells = self.cells
         tally_cells = self.tally_cells
+        plane = self.plane
+        zcylinder = self.zcylinder
         control_rod_list = self.control_rod_list
         instrument_tube_list = self.instrument_tube_list
 
+        flat = self.geometry_model == "flat"
         mats = openmc.Materials()
+        water_mats = {}
+        water_T = water_data.T.tolist()
+        water_rho = water_data.rho.tolist()
+
+        if self.water_binning:
+            self.water_bins = self.water_binning_creation(water_data)
+            bin_index = self.water_bins["index"].tolist()
+            bin_mats = []
+            for T, rho in zip(self.water_bins["T"], self.water_bins["rho"]):
+                water = self.water_material(next(self.material_ids), T, rho)
+                mats.append(water)
+                bin_mats.append(water)
+            self.water_bins["material_id"] = [water.id for water in bin_mats]
 
         for z in range(1, NN+1):
             for y in range(1, 35):
                 for x in range(1, 35):
-                    ID = water_material_id * 1000000 + z*10000 + y*100 + x
-                    water = openmc.Material(material_id=ID, name="water")
-                    water.set_density('kg/m3', water_data[x][y][z]["rho"])
-                    water.add_nuclide('H1', 4.6360E-02)
-                    water.add_nuclide('O16', 2.3180E-02)
-                    water.temperature = water_data[x][y][z]["T"]
-                    water.add_s_alpha_beta("c_H_in_H2O")
-                    mats.append(water)
-                    water_surface = openmc.model.RectangularParallelepiped(HCP*(x-1)+AG, HCP*(x)+AG, HCP*(y-1)+AG, HCP*(y)+AG, NH*(z-1), NH*(z))
-                    water_cell = openmc.Cell(cell_id=ID, fill=water, region=-water_surface)
+                    if self.water_binning:
+                        water = bin_mats[bin_index[z-1][y-1][x-1]]
+                    else:
+                        water = self.water_material(next(self.material_ids), water_T[z-1][y-1][x-1], water_rho[z-1][y-1][x-1])
+                        mats.append(water)
+                    water_mats[(z, y, x)] = water
+                    self.water_material_ids[z-1, y-1, x-1] = water.id
+                    if not flat:
+                        continue
+                    water_region = (+plane("x", HCP*(x-1)+AG) & -plane("x", HCP*(x)+AG) &
+                                    +plane("y", HCP*(y-1)+AG) & -plane("y", HCP*(y)+AG) &
+                                    +plane("z", NH*(z-1)) & -plane("z", NH*(z)))
+                    water_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=water, region=water_region)
+                    self.water_cell_ids[z-1, y-1, x-1] = water_cell.id
                     cells.append(water_cell)
 
         fuel = openmc.Material(material_id=fuel_material_id, name="fuel")
@@ -250,37 +429,41 @@ class NeInputGenerator:
         zircaloy.temperature = 600.0
         mats.append(zircaloy)
 
-        zmin = openmc.ZPlane(z0=0)
-        zmax = openmc.ZPlane(z0=AH)
+        self.materials = mats
+        temps = [mat.temperature for mat in mats if mat.temperature is not None]
+        self.temperature_range = (max(min(temps) - self.temperature_margin, 0.0), max(temps) + self.temperature_margin)
+
+        if flat:
+            zmin = plane("z", 0)
+            zmax = plane("z", AH)
+
+            for y in range(1, 18):
+                    for x in range(1, 18):
+                            fuel_surface = zcylinder(AG+(CP/2)+CP*(x-1), AG+(CP/2)+CP*(y-1), 0.4107)
+                            helium_surface = zcylinder(AG+(CP/2)+CP*(x-1), AG+(CP/2)+CP*(y-1), 0.4186)
+                            zircaloy_surface = zcylinder(AG+(CP/2)+CP*(x-1), AG+(CP/2)+CP*(y-1), 0.4757)
+                            helium_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=helium, region= +zmin & -zmax & +fuel_surface & -helium_surface)
+                            zircaloy_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=zircaloy, region= +zmin & -zmax & +helium_surface & -zircaloy_surface)
+                            cells.append(helium_cell)
+                            cells.append(zircaloy_cell)
+                            for z in range(1, NN+1):
+                                zlow = plane("z", NH*(z-1))
+                                zhigh = plane("z", NH*(z))
+                                fuel_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=fuel, region= +zlow & -zhigh & -fuel_surface)
+                                cells.append(fuel_cell)
+                                tally_cells.append(fuel_cell)
+                                self.tally_index.append((x, y, z))
+
+            assembly_univ = openmc.Universe(name="assembly", cells=cells)
+        else:
+            assembly_univ = self.lattice_universe(water_mats, fuel, helium, zircaloy)
 
-        for y in range(1, 18):
-                for x in range(1, 18):
-                        helium_id = helium_material_id * 1000000 + y*100 + x
-                        zircaloy_id = zircaloy_material_id * 1000000 + y*100 + x
-                        fuel_help_surface = openmc.ZCylinder(x0=AG+(CP/2)+CP*(x-1), y0=AG+(CP/2)+CP*(y-1), r=0.4107)
-                        helium_surface = openmc.ZCylinder(x0=AG+(CP/2)+CP*(x-1), y0=AG+(CP/2)+CP*(y-1), r=0.4186)
-                        zircaloy_surface = openmc.ZCylinder(x0=AG+(CP/2)+CP*(x-1), y0=AG+(CP/2)+CP*(y-1), r=0.4757)
-                        helium_cell = openmc.Cell(cell_id=helium_id, fill=helium, region= +zmin & -zmax & +fuel_help_surface & -helium_surface)
-                        zircaloy_cell = openmc.Cell(cell_id=zircaloy_id, fill=zircaloy, region= +zmin & -zmax & +helium_surface & -zircaloy_surface)
-                        cells.append(helium_cell)
-                        cells.append(zircaloy_cell)
-                        for z in range(1, NN+1):
-                            fuel_id = fuel_material_id * 1000000 + z * 10000 + y * 100 + x
-                            fuel_surface = openmc.ZCylinder(x0=AG+(CP/2)+CP*(x-1), y0=AG+(CP/2)+CP*(y-1), r=0.4107)
-                            zlow = openmc.ZPlane(z0 = NH*(z-1))
-                            zhigh = openmc.ZPlane(z0 = NH*(z))
-                            fuel_cell = openmc.Cell(cell_id=fuel_id, fill=fuel, region= +zlow & -zhigh & -fuel_surface)
-                            cells.append(fuel_cell)
-                            tally_cells.append(fuel_cell)
-
-        assembly_univ = openmc.Universe(name="assembly", cells=cells)
-
-        topboundary = openmc.ZPlane(z0=AH, boundary_type="vacuum")
-        bottomboundary = openmc.ZPlane(z0=0, boundary_type="vacuum")
-        northboundary = openmc.YPlane(y0=AG+CP*17, boundary_type="reflective") 
-        southboundary = openmc.YPlane(y0=AG, boundary_type="reflective") 
-        eastboundary = openmc.XPlane(x0=AG+CP*17, boundary_type="reflective")
-        westboundary = openmc.XPlane(x0=AG, boundary_type="reflective")
+        topboundary = plane("z", AH, boundary_type="vacuum")
+        bottomboundary = plane("z", 0, boundary_type="vacuum")
+        northboundary = plane("y", AG+CP*17, boundary_type="reflective") 
+        southboundary = plane("y", AG, boundary_type="reflective") 
+        eastboundary = plane("x", AG+CP*17, boundary_type="reflective")
+        westboundary = plane("x", AG, boundary_type="reflective")
 
         boundary = (+southboundary & -northboundary & +westboundary  & -eastboundary  & +bottomboundary & -topboundary) 
 
@@ -290,16 +473,161 @@ class NeInputGenerator:
         mats.export_to_xml(results_dir)
         geom.export_to_xml(results_dir)
 
+    def water_material(self, ID, T, rho):
+
+        water = openmc.Material(material_id=ID, name="water")
+        water.set_density('kg/m3', rho)
+        water.add_nuclide('H1', 4.6360E-02)
+        water.add_nuclide('O16', 2.3180E-02)
+        water.temperature = T
+        water.add_s_alpha_beta("c_H_in_H2O")
+        return water
+
+    def water_binning_creation(self, water_data):
+        # Groupes de largeur T_tolerance x rho_tolerance : un matériau par groupe non vide,
+        # à la température et la densité moyennes de ses voxels. Les cellules restent une par voxel.
+        T = water_data.T[:self.NN, :34, :34]
+        rho = water_data.rho[:self.NN, :34, :34]
+        keys = np.stack([np.floor(T.ravel() / self.T_tolerance),
+                         np.floor(rho.ravel() / self.rho_tolerance)], axis=1)
+        _, index = np.unique(keys, axis=0, return_inverse=True)
+        index = index.reshape(T.shape)
+        T_bin, rho_bin = self.water_bins_report(index, T, rho)
+        return {"index": index, "T": T_bin, "rho": rho_bin}
+
+    def water_bins_report(self, index, T, rho):
+        # Moyennes et écarts max par groupe, réécrits dans water_bins.txt à chaque itération :
+        # en session persistante le regroupement est figé et les voxels peuvent dériver hors tolérance
+        index = index.ravel()
+        counts = np.bincount(index)
+        T_bin = np.bincount(index, T.ravel()) / counts
+        rho_bin = np.bincount(index, rho.ravel()) / counts
+
+        T_err = np.zeros(len(counts))
+        rho_err = np.zeros(len(counts))
+        np.maximum.at(T_err, index, np.abs(T.ravel() - T_bin[index]))
+        np.maximum.at(rho_err, index, np.abs(rho.ravel() - rho_bin[index]))
+
+        report = os.path.join(self.results_dir, "water_bins.txt")
+        np.savetxt(report, np.column_stack([np.arange(1, len(counts)+1), counts, T_bin, rho_bin, T_err, rho_err]),
+                   fmt=["%d", "%d", "%.4f", "%.4f", "%.4e", "%.4e"], header="bin voxels T rho T_err_max rho_err_max")
+        print(f"Eau : {T.size} voxels regroupés en {len(counts)} matériaux "
+              f"(erreur max T = {T_err.max():.3g} K, rho = {rho_err.max():.3g} kg/m3)")
+        drifted = np.count_nonzero((T_err > self.T_tolerance) | (rho_err > self.rho_tolerance))
+        if drifted:
+            print(f"⚠️ {drifted} groupes d'eau dépassent la tolérance (T_tolerance = {self.T_tolerance} K, "
+                  f"rho_tolerance = {self.rho_tolerance} kg/m3) : regroupement à refaire hors session")
+        return T_bin, rho_bin
+
+    def lattice_universe(self, water_mats, fuel, helium, zircaloy):
+        # Modèle en réseaux imbriqués : un univers crayon par (x, y, z), un réseau 17x17 par nœud
+        # et un réseau axial de nœuds. Comme dans le modèle plat : une cellule d'eau par voxel,
+        # une cellule combustible par nœud, IDs tirés du même compteur.
+        CP = self.CP
+        AG = self.AG
+        NN = self.NN
+        NH = self.AH/self._NN
+        cells = self.cells
+        tally_cells = self.tally_cells
+
+        # Surfaces locales au crayon, partagées par tous les univers
+        fuel_surface = self.zcylinder(0.0, 0.0, 0.4107)
+        helium_surface = self.zcylinder(0.0, 0.0, 0.4186)
+        zircaloy_surface = self.zcylinder(0.0, 0.0, 0.4757)
+        xmid = self.plane("x", 0.0)
+        ymid = self.plane("y", 0.0)
+        quadrants = {(0, 0): -xmid & -ymid, (1, 0): +xmid & -ymid,
+                     (0, 1): -xmid & +ymid, (1, 1): +xmid & +ymid}
+
+        pins = {}
+        for y in range(1, 18):
+            for x in range(1, 18):
+                for z in range(1, NN+1):
+                    fuel_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=fuel, region=-fuel_surface)
+                    helium_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=helium, region=+fuel_surface & -helium_surface)
+                    zircaloy_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=zircaloy, region=+helium_surface & -zircaloy_surface)
+                    pin_cells = [fuel_cell, helium_cell, zircaloy_cell]
+                    # Eau : les 4 voxels en demi-pas autour du crayon
+                    for (dx, dy), quadrant in quadrants.items():
+                        wx, wy = 2*x - 1 + dx, 2*y - 1 + dy
+                        water_cell = openmc.Cell(cell_id=next(self.cell_ids), fill=water_mats[(z, wy, wx)],
+                                                 region=+zircaloy_surface & quadrant)
+                        self.water_cell_ids[z-1, wy-1, wx-1] = water_cell.id
+                        pin_cells.append(water_cell)
+                    cells.extend(pin_cells)
+                    tally_cells.append(fuel_cell)
+                    self.tally_index.append((x, y, z))
+                    pins[(z, y, x)] = openmc.Universe(cells=pin_cells)
+
+        node_univs = []
+        for z in range(1, NN+1):
+            node_lattice = openmc.RectLattice(name=f"node_{z}")
+            node_lattice.pitch = (CP, CP)
+            node_lattice.lower_left = (-CP*17/2, -CP*17/2)
+            # Ligne 0 du réseau = y le plus grand
+            node_lattice.universes = [[pins[(z, y, x)] for x in range(1, 18)] for y in range(17, 0, -1)]
+            node_univs.append(openmc.Universe(cells=[openmc.Cell(fill=node_lattice)]))
+
+        axial_lattice = openmc.RectLattice(name="axial")
+        axial_lattice.pitch = (CP*17, CP*17, NH)
+        axial_lattice.lower_left = (AG, AG, 0.0)
+        axial_lattice.universes = [[[node_univs[z-1]]] for z in range(1, NN+1)]
+
+        return openmc.Universe(name="assembly", cells=[openmc.Cell(fill=axial_lattice)])
+
+    # Registre de surfaces : une seule surface par plan ou cylindre distinct
+
+    def plane(self, axis, coord, boundary_type=None):
+
+        key = (axis, round(coord, 9))
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = {"x": openmc.XPlane, "y": openmc.YPlane, "z": openmc.ZPlane}[axis](coord)
+            self.surfaces[key] = surface
+        if boundary_type is not None:
+            surface.boundary_type = boundary_type
+        return surface
+
+    def zcylinder(self, x0, y0, r):
+
+        key = ("zcylinder", round(x0, 9), round(y0, 9), round(r, 9))
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = openmc.ZCylinder(x0=x0, y0=y0, r=r)
+            self.surfaces[key] = surface
+        return surface
+
     def tallies_creation(self):
 
         results_dir = self.results_dir
         tally_cells = self.tally_cells
 
         tally = openmc.Tally(name="heating_per_cell")
-        tally.filters = [openmc.CellFilter(tally_cells)]
+        if self.tally_backend == "mesh":
+            # Une maille par crayon et par nœud, restreinte au combustible : lecture par reshape (nz, ny, nx)
+            mesh = openmc.RegularMesh(name="pin_mesh")
+            mesh.lower_left = (self.AG, self.AG, 0.0)
+            mesh.upper_right = (self.AG + self.CP*17, self.AG + self.CP*17, self.AH)
+            mesh.dimension = (17, 17, self.NN)
+            tally.filters = [openmc.MeshFilter(mesh), openmc.MaterialFilter([self.fuel_material_id])]
+        else:
+            tally.filters = [openmc.CellFilter(tally_cells)]
+            self.tally_map_write()
         tally.scores = ["heating"]
+        if self.trigger_rel_err is not None:
+            tally.triggers = [openmc.Trigger("rel_err", self.trigger_rel_err)]
         openmc.Tallies([tally]).export_to_xml(results_dir)
 
+    def tally_map_write(self):
+        # Table ID de cellule -> (ix, iy, iz) : seule correspondance entre tally et grille.
+        # Écrite dans le dossier de chaque itération, y compris celles d'une session persistante.
+        if self.tally_backend != "cell":
+            return
+        ix, iy, iz = np.array(self.tally_index, dtype=np.int64).T
+        FieldExchange().write(os.path.join(self.results_dir, "tally_map.bin"),
+                              {"cell_id": np.array([cell.id for cell in self.tally_cells], dtype=np.int64),
+                               "ix": ix, "iy": iy, "iz": iz})
+
     def settings_creation(self):
  
         CP = self.CP 
@@ -313,26 +641,109 @@ class NeInputGenerator:
         settings = openmc.Settings()
         settings.temperature = {
         "method": "interpolation",  
-        "range": (250.0, 2500.0),   
+        "range": self.temperature_range,   
         "tolerance": 50.0}
 
-        src = openmc.IndependentSource()
-        src.space  = openmc.stats.Box((AG, AG, 0.0), (CP*17+AG, CP*17+AG, AH), only_fissionable=True)
-        src.angle  = openmc.stats.Isotropic()
-        settings.source = src
+        previous_source = self.previous_source if self.warm_start else None
+        self.warm_started = previous_source is not None
+        if self.warm_started:
+            print(f"Démarrage à chaud depuis {previous_source}")
+            settings.source = openmc.FileSource(previous_source)
+            inactive = min(self.warm_inactive, inactive)
+        else:
+            src = openmc.IndependentSource()
+            src.space  = openmc.stats.Box((AG, AG, 0.0), (CP*17+AG, CP*17+AG, AH), only_fissionable=True)
+            src.angle  = openmc.stats.Isotropic()
+            settings.source = src
+
+        # Source finale conservée pour l'itération suivante, entropie sur un maillage axial
+        # (assemblage réfléchi radialement : la source se déplace surtout en z)
+        settings.sourcepoint = {"separate": True, "write": True}
+        entropy_mesh = openmc.RegularMesh()
+        entropy_mesh.lower_left = (AG, AG, 0.0)
+        entropy_mesh.upper_right = (CP*17+AG, CP*17+AG, AH)
+        entropy_mesh.dimension = (1, 1, self.NN)
+        settings.entropy_mesh = entropy_mesh
  
+        if self.trigger_rel_err is not None:
+            # batches devient le maximum, la simulation s'arrête dès que le trigger est atteint
+            settings.trigger_active = True
+            settings.trigger_max_batches = batches
+
         self.settings = settings
-        settings._batches = batches
+        settings._batches = self.run_batches(inactive)
         settings._inactive = inactive
         settings._particles = particles
         settings.summary = False
         settings.export_to_xml(results_dir)
 
-    def geometry_plot(self):
+    def run_batches(self, inactive):
+
+        if self.trigger_rel_err is None:
+            return self.batches
+        return min(self.batches, inactive + self.trigger_min_active)
+
+    def temperature_covered(self, water_data):
+        # Les données nucléaires d'une session ouverte ne couvrent que temperature_range
+        T = water_data.T[:self.NN, :34, :34]
+        T_min, T_max = self.temperature_range
+        return T_min <= T.min() and T.max() <= T_max
+
+    def xs_memory_report(self):
+        # Estimation de la mémoire des sections efficaces : jeux de données HDF5 chargés
+        # pour temperature_range (plus les deux températures encadrantes, interpolation)
+        T_min, T_max = self.temperature_range
+        try:
+            library = openmc.data.DataLibrary.from_xml(openmc.config["cross_sections"])
+        except (KeyError, OSError) as e:
+            print(f"⚠️ Mémoire des sections efficaces non estimée : {e}")
+            return
+
+        names = {(name, "neutron") for mat in self.materials for name in mat.get_nuclides()}
+        names |= {(name, "thermal") for mat in self.materials for name, _ in mat._sab}
+
+        total = 0
+        for name, data_type in sorted(names):
+            entry = library.get_by_material(name, data_type=data_type)
+            if entry is None:
+                continue
+            with h5py.File(entry["path"], "r") as f:
+                total += self.loaded_bytes(f, T_min, T_max)
+
+        print(f"Sections efficaces : {total/1024**2:.1f} Mo pour {len(names)} nucléides/S(a,b) "
+              f"entre {T_min:.1f} K et {T_max:.1f} K")
+        return total
+
+    def loaded_bytes(self, h5file, T_min, T_max):
+
+        sizes = {}
+        def visit(name, obj):
+            if isinstance(obj, h5py.Dataset):
+                T = None
+                for part in name.split("/"):
+                    match = re.fullmatch(r"(\d+)K", part)
+                    if match:
+                        T = int(match.group(1))
+                sizes[T] = sizes.get(T, 0) + obj.size * obj.dtype.itemsize
+        h5file.visititems(visit)
+
+        temps = sorted(T for T in sizes if T is not None)
+        below = [T for T in temps if T <= T_min]
+        above = [T for T in temps if T >= T_max]
+        low = below[-1] if below else temps[0] if temps else 0
+        high = above[0] if above else temps[-1] if temps else 0
+        return sum(size for T, size in sizes.items() if T is None or low <= T <= high)
 
+    def geometry_plot(self):
+        # Tracé seulement si geometry.xml a changé depuis le dernier tracé, rendu dans la file de post-traitement
         AP = self.AP
         results_dir = self.results_dir
 
+        with open(os.path.join(results_dir, "geometry.xml"), "rb") as f:
+            geometry_hash = hashlib.sha256(f.read()).hexdigest()
+        if geometry_hash == self.plotted_geometry:
+            return
+
         plot = openmc.Plot()
         plot.basis = 'xy'                 
         plot.origin = (AP/2, AP/2, 200.0)    
@@ -342,7 +753,11 @@ class NeInputGenerator:
 
         plots = openmc.Plots([plot])
         plots.export_to_xml(path=os.path.join(results_dir, "plots.xml"))
+        self.post.submit(self.geometry_render, results_dir, geometry_hash)
 
+    def geometry_render(self, results_dir, geometry_hash=None):
+        # L'empreinte n'est retenue qu'une fois l'image produite : une tâche abandonnée
+        # (file pleine) ou en échec sera retentée au prochain appel
         openmc.plot_geometry(cwd=results_dir)
 
         ppm_file = os.path.join(results_dir, "plot_1.ppm")
@@ -352,18 +767,105 @@ class NeInputGenerator:
             img = Image.open(ppm_file)
             img.save(png_file)
             print(f"Image convertie : {png_file}")
+            if geometry_hash is not None:
+                self.plotted_geometry = geometry_hash
         else:
             print("⚠️ Aucun fichier PPM trouvé")
 
     def simulation_runner(self):
 
         results_dir = self.results_dir
-        openmc.run(cwd=results_dir, threads=12)
+        self.clear_run_files()
+        openmc.run(cwd=results_dir, threads=self.threads)
 
-        n = self.settings.batches
-        with openmc.StatePoint(os.path.join(results_dir, f"statepoint.{n}.h5")) as sp:
+        with openmc.StatePoint(self.statepoint_path) as sp:
             keff = sp.keff
-            print(f'Final k-effective = {keff}')
+            entropy = sp.entropy
+
+        if self.warm_started and self.settings.inactive < self.inactive and self.source_shifted(entropy):
+            print("⚠️ Source déplacée depuis l'itération précédente, relance avec tous les batches inactifs")
+            self.settings.inactive = self.inactive
+            self.settings.batches = self.run_batches(self.inactive)
+            self.settings.export_to_xml(results_dir)
+            self.clear_run_files()
+            openmc.run(cwd=results_dir, threads=self.threads)
+            with openmc.StatePoint(self.statepoint_path) as sp:
+                keff = sp.keff
+
+        print(f'Final k-effective = {keff}')
+
+    def source_shifted(self, entropy):
+        # Entropie du premier batch (source reprise) comparée à celle des batches actifs
+        active = np.asarray(entropy[self.settings.inactive:])
+        if active.size == 0:
+            return False
+        return abs(entropy[0] - active.mean()) > max(3 * active.std(), self.entropy_tolerance * active.mean())
+
+    def clear_run_files(self):
+        # Statepoints et sources d'un calcul précédent dans le même dossier (numéros de batch variables)
+        for path in glob.glob(os.path.join(self.results_dir, "statepoint.*.h5")) + \
+                    glob.glob(os.path.join(self.results_dir, "source.*.h5")):
+            os.remove(path)
+
+    # Session openmc.lib persistante : données nucléaires et géométrie chargées une seule fois
+
+    def session_init(self):
+
+        lib.init(args=["-s", str(self.threads), self.results_dir])
+        self._session_open = True
+
+    def session_update(self, water_data):
+        # Nouvelles densités et températures de l'eau poussées directement dans la session
+        water_T = water_data.T.tolist()
+        water_rho = water_data.rho.tolist()
+
+        if self.water_binning:
+            # Les matériaux de la session sont figés : on garde le regroupement initial
+            # et on met à jour la moyenne de chaque groupe
+            T_bin, rho_bin = self.water_bins_report(self.water_bins["index"], water_data.T[:self.NN, :34, :34],
+                                                    water_data.rho[:self.NN, :34, :34])
+            self.water_bins["T"], self.water_bins["rho"] = T_bin, rho_bin
+            for ID, rho in zip(self.water_bins["material_id"], rho_bin):
+                lib.materials[ID].set_density(rho / 1000, "g/cm3")
+            water_T = T_bin[self.water_bins["index"]].tolist()
+        else:
+            for z in range(1, self.NN+1):
+                for y in range(1, 35):
+                    for x in range(1, 35):
+                        ID = int(self.water_material_ids[z-1, y-1, x-1])
+                        lib.materials[ID].set_density(water_rho[z-1][y-1][x-1] / 1000, "g/cm3")
+
+        for z in range(1, self.NN+1):
+            for y in range(1, 35):
+                for x in range(1, 35):
+                    ID = int(self.water_cell_ids[z-1, y-1, x-1])
+                    lib.cells[ID].set_temperature(water_T[z-1][y-1][x-1])
+
+        lib.settings.batches = self.run_batches(self.inactive)
+        lib.settings.inactive = self.inactive
+        lib.settings.particles = self.particles
+
+    def session_run(self):
+
+        results_dir = self.results_dir
+        self.clear_run_files()
+        self.tally_map_write() #Les cellules de la session sont celles de la première construction
+        cwd = os.getcwd()
+        os.chdir(results_dir) #statepoint écrit dans le dossier de l'itération
+        try:
+            lib.hard_reset()
+            lib.run()
+        finally:
+            os.chdir(cwd)
+
+        keff = lib.keff()
+        print(f'Final k-effective = {keff}')
+
+    def session_close(self):
+
+        if self._session_open:
+            lib.finalize()
+            self._session_open = False
 
 if __name__ == "__main__":
     try:
@@ -1,10 +1,12 @@
 import openmc
 import numpy as np
 import os
+import glob
 import time
 import sys
-import pandas as pd
-import matplotlib.pyplot as plt
+from Coupling.FieldExchange import FieldExchange
+from matplotlib.figure import Figure
+from Coupling.PostProcessor import PostProcessor
 from IPython.display import Image
 
 __all__ = ["NeOutputReader"]
@@ -23,6 +25,9 @@ class NeOutputReader:
         self._batches = 0
         self._iteration = 0
         self._casename = "default"
+        self.write_csv = True #NE_output.csv est lu par la source codée fvOptions
+        self.async_write = False #Écriture des fichiers en arrière-plan, champs renvoyés par main()
+        self.post = PostProcessor() #Figures exécutées sur place sauf si MainCoupling fournit sa file
 
     @property
     def NN(self):
@@ -72,6 +77,10 @@ class NeOutputReader:
 
     @property
     def output_dir(self):
+        return os.path.join(os.getcwd(), "Results", self.casename, str(int(self.iteration)+1), "NE_output.bin")
+
+    @property
+    def csv_output_dir(self):
         return os.path.join(os.getcwd(), "Results", self.casename, str(int(self.iteration)+1), "NE_output.csv")
     
     @property
@@ -91,94 +100,93 @@ class NeOutputReader:
         P_target = self.P_target
         os.makedirs(results_dir, exist_ok=True)
 
-        tally_power, tally_id = self.output_read(results_dir)
-        self.output_plot(tally_id, tally_power, P_target, NN)
-        ix, iy, iz, Pw = self.output_file_creation(tally_id, tally_power, P_target, NN)
+        power = self.output_read(results_dir)
+        self.output_plot(power, P_target, NN)
+        ix, iy, iz, Pw = self.output_file_creation(power, P_target)
 
         data = {"ix": ix, "iy": iy, "iz": iz, "Power": Pw}
         
-        df = pd.DataFrame(data)
         os.makedirs(os.path.dirname(output_dir), exist_ok=True)
-        df.to_csv(output_dir, index=False, float_format="%.8f")
-        print(f"Écriture de {output_dir} finie.")
+        if self.async_write:
+            FieldExchange().write_async(output_dir, data, self.csv_output_dir if self.write_csv else None)
+        else:
+            FieldExchange().write(output_dir, data)
+            if self.write_csv:
+                FieldExchange().write_csv(self.csv_output_dir, data)
+        print(f"Écriture de {output_dir} lancée." if self.async_write else f"Écriture de {output_dir} finie.")
 
         end=time.time()
         print(f"Lecture des résultats NE en {round(end-start, 0)}s")
+        return data
 
     def output_read(self, results_dir):
 
-        n = self.batches
+        # Dernier statepoint : avec les triggers, la simulation peut s'arrêter avant batches
+        statepoints = glob.glob(os.path.join(results_dir, "statepoint.*.h5"))
+        if not statepoints:
+            raise RuntimeError(f"Aucun statepoint dans {results_dir}")
+        statepoint = max(statepoints, key=lambda path: int(os.path.basename(path).split(".")[1]))
 
-        with openmc.StatePoint(os.path.join(results_dir, f"statepoint.{n}.h5")) as sp: 
+        with openmc.StatePoint(statepoint) as sp: 
             tally = sp.get_tally(name="heating_per_cell")
+            if isinstance(tally.filters[0], openmc.MeshFilter):
+                # Bins du MeshFilter ordonnés x le plus rapide : tableau dense (nz, ny, nx)
+                nx, ny, nz = tally.filters[0].mesh.dimension
+                return tally.mean.reshape(nz, ny, nx)
             tally_power = tally.mean.ravel()
-            tally_id =  tally.filters[0].bins 
-
-        return tally_power, tally_id
-    
-    def output_file_creation(self, tally_id, tally_power, P_target, NN):
-
+            tally_id = np.asarray(tally.filters[0].bins, dtype=np.int64)
+
+        ix, iy, iz = self.tally_indices(tally_id, results_dir)
+        power = np.full((iz.max(), iy.max(), ix.max()), np.nan)
+        power[iz-1, iy-1, ix-1] = tally_power
+        return power
+
+    def tally_indices(self, tally_id, results_dir):
+        # Indices (ix, iy, iz) des cellules tally : table tally_map.bin écrite par NeInputGenerator,
+        # les IDs de cellule ne portent aucune information de position
+        map_path = os.path.join(results_dir, "tally_map.bin")
+        if not os.path.exists(map_path):
+            raise RuntimeError(f"Table des cellules tally absente : {map_path}")
+        table = FieldExchange().read(map_path)
+        cell_id = np.asarray(table["cell_id"])
+        order = np.argsort(cell_id)
+        pos = np.searchsorted(cell_id, tally_id, sorter=order).clip(max=len(cell_id)-1)
+        rows = order[pos]
+        if np.any(cell_id[rows] != tally_id):
+            raise RuntimeError(f"Cellules tally absentes de {map_path}")
+        return tuple(np.asarray(table[name])[rows] for name in ("ix", "iy", "iz"))
+
+    def output_file_creation(self, power, P_target):
+        # Lignes dans l'ordre des tally_cells : y, puis x, puis z
         print("CSV output file writing...")
-        nz = NN
-        nx = self.nx
-        ny = self.ny
-
-        ncell = nx * ny * nz
-        IX = np.empty(ncell, dtype=np.int64)
-        IY = np.empty(ncell, dtype=np.int64)
-        IZ = np.empty(ncell, dtype=np.int64)
-        Pw = np.full(ncell, np.nan)
-
-        ix = str(tally_id)[5:7]
-        iy = str(tally_id)[3:5]
-        iz = str(tally_id)[1:3]
-
-        P_tot = tally_power.sum()
-        P_cells = np.round(P_target * tally_power / P_tot, 5)
-
-        idx = 0
-        for j in range(1, ny+1):          
-            for i in range(1, nx+1):      
-                for k in range(1, nz+1):  
-                    ix = str(tally_id[idx])[5:7]
-                    iy = str(tally_id[idx])[3:5]
-                    iz = str(tally_id[idx])[1:3]
-                    IX[idx], IY[idx], IZ[idx] = ix, iy, iz
-                    Pw[idx] = P_cells[idx]
-                    idx += 1
-
+        P_cells = np.round(P_target * power / power.sum(), 5)
+        IZ, IY, IX = np.indices(power.shape) + 1
+        order = (1, 2, 0)
+        IX, IY, IZ, Pw = (a.transpose(order).ravel() for a in (IX, IY, IZ, P_cells))
         print("CSV output file writed")
         return IX, IY, IZ, Pw
 
+    def output_plot(self, power, P_target, NN):
+        # Réduction axiale (moyenne par nœud) par reshape
+        P_cells = np.round(P_target * power / power.sum(), 5)
+        self.z_list = list(P_cells.reshape(NN, -1).mean(axis=1))
+        self.z_values = np.arange(1, NN+1)
+
+        plot_path = os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "Z mesh power plot")
+        self.post.submit(self.save_plot, self.z_values, self.z_list, plot_path, iteration=self.iteration)
 
-    def output_plot(self, tally_id, tally_power, P_target, NN):
+    def save_plot(self, z_values, z_list, plot_path):
 
         print("Mesh power plot creation...")
-        P_tot = tally_power.sum()
-        P_cells = np.round(P_target * tally_power / P_tot, 5)
-
-        heat_power = {cid: val for cid, val in zip(tally_id, P_cells)}
-
-        self.z_list = []
-        for z in range (1, NN+1):
-            if z < 10:
-                z_value = str(z).zfill(2)
-            else:
-                z_value = z
-            xy_list = []
-            for key in heat_power.keys():
-                if str(key)[1:3] == str(z_value):
-                    xy_list.append(heat_power[key])
-            self.z_list.append(np.mean(xy_list))
-        self.z_values = np.arange(1, NN+1)  
-
-        plt.plot(self.z_values, self.z_list, marker="o", linestyle="-")
-
-        plt.xlabel("Nodes")
-        plt.ylabel("Power in Watts")
-        plt.title("Power in a node")
-        plt.grid(True)
-        plt.savefig(os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration),"Z mesh power plot"), dpi=300, bbox_inches="tight")
+        fig = Figure()
+        ax = fig.add_subplot()
+        ax.plot(z_values, z_list, marker="o", linestyle="-")
+
+        ax.set_xlabel("Nodes")
+        ax.set_ylabel("Power in Watts")
+        ax.set_title("Power in a node")
+        ax.grid(True)
+        fig.savefig(plot_path, dpi=300, bbox_inches="tight")
         print("Mesh power plot created")
 
 if __name__ == "__main__":
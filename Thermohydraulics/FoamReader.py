@@ -0,0 +1,345 @@
+import os
+import re
+import gzip
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+__all__ = ["FoamReader"]
+
+class FoamReader:
+
+    # Lecture directe des fichiers OpenFOAM (ascii ou binary, compressés ou non)
+    # sans passer par postProcess / foamToVTK
+
+    def latest_time_dir(self, case_dir):
+
+        time_dirs = [
+        d for d in os.listdir(case_dir)
+        if os.path.isdir(os.path.join(case_dir, d))
+        and re.fullmatch(r"\d+(\.\d+)?", d)]
+
+        time_dirs_sorted = sorted(time_dirs, key=lambda x: float(x))
+        return os.path.join(case_dir, time_dirs_sorted[-1])
+
+    def open_foam_file(self, path):
+        # Renvoie le contenu (memmap si possible) et l'en-tête FoamFile
+        if not os.path.exists(path) and os.path.exists(path + ".gz"):
+            path = path + ".gz"
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Fichier OpenFOAM introuvable : {path}")
+
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as f:
+                buf = f.read()
+            mm = None
+        else:
+            mm = np.memmap(path, dtype=np.uint8, mode="r")
+            buf = None
+
+        head = buf[:65536] if buf is not None else mm[:65536].tobytes()
+        header = self.read_header(head)
+        if buf is None and header["format"] == "ascii":
+            buf = mm.tobytes()
+            mm = None
+        return path, buf, mm, head, header
+
+    def read_header(self, head):
+
+        match = re.search(rb"FoamFile\s*\{(.*?)\}", head, re.S)
+        if match is None:
+            raise RuntimeError("En-tête FoamFile introuvable.")
+        header = {k.decode(): v.strip(b'" ').decode() for k, v in re.findall(rb'(\w+)\s+("[^"]*"|[^;]+);', match.group(1))}
+        header.setdefault("format", "ascii")
+        header["end"] = match.end()
+
+        arch = header.get("arch", "")
+        label = re.search(r"label=(\d+)", arch)
+        scalar = re.search(r"scalar=(\d+)", arch)
+        header["label_dtype"] = np.dtype("<i8") if label and label.group(1) == "64" else np.dtype("<i4")
+        header["scalar_dtype"] = np.dtype("<f4") if scalar and scalar.group(1) == "32" else np.dtype("<f8")
+        return header
+
+    def text_at(self, buf, mm, pos):
+        # Texte à partir de pos (fenêtre courte en binaire pour ne pas charger le fichier)
+        if buf is not None:
+            return buf, pos
+        return mm[pos:pos+4096].tobytes(), 0
+
+    def skip_comments(self, buf, mm, pos):
+
+        text, rel = self.text_at(buf, mm, pos)
+        while True:
+            match = re.compile(rb"\s*(//[^\n]*|/\*.*?\*/)", re.S).match(text, rel)
+            if match is None:
+                return rel if buf is not None else pos + rel
+            rel = match.end()
+
+    def read_list(self, path, buf, mm, header, pos, dtype, ncomp):
+        # Lit une liste "N(...)" à partir de pos ; renvoie (tableau, position après la liste)
+        text, rel = self.text_at(buf, mm, pos)
+        match = re.compile(rb"\s*(\d+)\s*([({])").match(text, rel)
+        if match is None:
+            raise RuntimeError(f"Liste OpenFOAM illisible dans {path}")
+        n = int(match.group(1))
+        start = pos + match.end() - rel
+        shape = (n, ncomp) if ncomp > 1 else n
+
+        if match.group(2) == b"{":
+            # Liste uniforme "N{valeur}"
+            if header["format"] == "binary":
+                text, rel = self.text_at(buf, mm, start)
+                value = np.frombuffer(text, dtype=dtype, count=ncomp, offset=rel)
+                end = start + ncomp*dtype.itemsize + 1
+            else:
+                end = buf.index(b"}", start) + 1
+                value = np.array(buf[start:end-1].replace(b"(", b" ").replace(b")", b" ").split(), dtype=dtype)
+            return np.tile(value, (n, 1)).reshape(shape), end
+
+        if header["format"] == "binary":
+            count = n * ncomp
+            if mm is not None:
+                data = np.memmap(path, dtype=dtype, mode="r", offset=start, shape=count) if count else np.empty(0, dtype)
+            else:
+                data = np.frombuffer(buf, dtype=dtype, count=count, offset=start)
+            return data.reshape(shape), start + count*dtype.itemsize + 1
+
+        depth = 1 if ncomp == 1 else n + 1
+        end = start
+        for _ in range(depth):
+            end = buf.index(b")", end) + 1
+        tokens = buf[start:end-1].replace(b"(", b" ").replace(b")", b" ").split()
+        return np.array(tokens, dtype=dtype).reshape(shape), end
+
+    def read_field(self, path, ncells=None):
+
+        path, buf, mm, head, header = self.open_foam_file(path)
+        ncomp = 3 if "Vector" in header.get("class", "") else 1
+        dtype = header["scalar_dtype"]
+
+        text = head if buf is None else buf
+        match = re.compile(rb"internalField\s+(uniform|nonuniform)\s*").search(text, header["end"])
+        if match is None:
+            raise RuntimeError(f"internalField introuvable dans {path}")
+
+        if match.group(1) == b"uniform":
+            end = text.index(b";", match.end())
+            value = np.array(text[match.end():end].replace(b"(", b" ").replace(b")", b" ").split(), dtype=np.float64)
+            if ncells is None:
+                raise RuntimeError(f"Champ uniforme dans {path} : nombre de cellules requis")
+            return np.tile(value, (ncells, 1)).reshape((ncells, ncomp) if ncomp > 1 else ncells)
+
+        pos = re.compile(rb"List<\w+>").match(text, match.end()).end()
+        data, _ = self.read_list(path, buf, mm, header, pos, dtype, ncomp)
+        return data
+
+    def read_mesh_list(self, path, kind):
+
+        path, buf, mm, head, header = self.open_foam_file(path)
+        pos = self.skip_comments(buf, mm, header["end"])
+
+        if kind == "points":
+            data, _ = self.read_list(path, buf, mm, header, pos, header["scalar_dtype"], 3)
+            return data
+        if kind == "labels":
+            data, _ = self.read_list(path, buf, mm, header, pos, header["label_dtype"], 1)
+            return data
+
+        # Faces : faceCompactList (décalages + indices) ou faceList ascii "n(a b c ...)"
+        label_dtype = header["label_dtype"]
+        if header.get("class") == "faceCompactList":
+            offsets, pos = self.read_list(path, buf, mm, header, pos, label_dtype, 1)
+            pos = self.skip_comments(buf, mm, pos)
+            points, _ = self.read_list(path, buf, mm, header, pos, label_dtype, 1)
+            return np.asarray(offsets, dtype=np.int64), np.asarray(points, dtype=np.int64)
+
+        match = re.compile(rb"\s*(\d+)\s*\(").match(buf, pos)
+        nfaces = int(match.group(1))
+        end = re.compile(rb"\)\s*\)").search(buf, match.start()).start() + 1
+        body = buf[match.end():end]
+        tokens = np.array(body.replace(b"(", b" ").replace(b")", b" ").split(), dtype=np.int64)
+
+        # Tête de face (taille) = dernier entier commencé avant chaque "(" : rang de l'entier
+        # par somme cumulée des débuts de nombres, sans boucle sur les faces
+        chars = np.frombuffer(body, dtype=np.uint8)
+        digit = (chars >= ord("0")) & (chars <= ord("9"))
+        starts = digit.copy()
+        starts[1:] &= ~digit[:-1]
+        heads = (np.cumsum(starts) - 1)[chars == ord("(")]
+        if heads.size != nfaces:
+            raise RuntimeError(f"{path} : {heads.size} faces lues au lieu de {nfaces}")
+        sizes = tokens[heads]
+        keep = np.ones(tokens.size, dtype=bool)
+        keep[heads] = False
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        return offsets, tokens[keep]
+
+    def read_mesh(self, case_dir):
+
+        mesh_dir = os.path.join(case_dir, "constant", "polyMesh")
+        face_offsets, face_points = self.read_mesh_list(os.path.join(mesh_dir, "faces"), "faces")
+        mesh = {
+            "points": np.asarray(self.read_mesh_list(os.path.join(mesh_dir, "points"), "points"), dtype=np.float64),
+            "face_offsets": face_offsets,
+            "face_points": face_points,
+            "owner": np.asarray(self.read_mesh_list(os.path.join(mesh_dir, "owner"), "labels"), dtype=np.int64),
+            "neighbour": np.asarray(self.read_mesh_list(os.path.join(mesh_dir, "neighbour"), "labels"), dtype=np.int64),
+        }
+        mesh["ncells"] = int(max(mesh["owner"].max(), mesh["neighbour"].max(initial=-1))) + 1
+        return mesh
+
+    def read_fields(self, case_dir, names, ncells=None):
+
+        time_dir = self.latest_time_dir(case_dir)
+        return {name: self.read_field(os.path.join(time_dir, name), ncells) for name in names}
+
+    # Construction du vtkUnstructuredGrid en mémoire
+
+    def cell_faces(self, mesh):
+        # Faces de chaque cellule, orientées vers l'extérieur (faces internes retournées côté voisin)
+        fo, fp = mesh["face_offsets"], mesh["face_points"]
+        owner, neighbour = mesh["owner"], mesh["neighbour"]
+        nfaces, ninternal = owner.size, neighbour.size
+        sizes = np.diff(fo)
+
+        fid = np.repeat(np.arange(ninternal), sizes[:ninternal])
+        pos = np.arange(fo[ninternal])
+        reversed_points = fp[fo[fid+1] - 1 - (pos - fo[fid])]
+
+        face_sizes = np.concatenate((sizes, sizes[:ninternal]))
+        face_offsets = np.concatenate(([0], np.cumsum(face_sizes)))
+        face_points = np.concatenate((fp, reversed_points))
+
+        cell_of_face = np.concatenate((owner, neighbour))
+        order = np.argsort(cell_of_face, kind="stable")
+        face_ids = np.concatenate((np.arange(nfaces), nfaces + np.arange(ninternal)))[order]
+        faces_per_cell = np.bincount(cell_of_face, minlength=mesh["ncells"])
+        return face_offsets, face_points, face_ids, faces_per_cell
+
+    # Cellules reconnues par leur nombre de faces et la taille de ces faces, écrites en cellules VTK
+    # natives comme foamToVTK : (type, faces, triangles, quadrangles, taille de la base, construction).
+    # Base = face sortante retournée (normale vers l'intérieur), puis sommet ("apex") ou
+    # face opposée, point par point le long des arêtes latérales ("extrude")
+    SHAPES = [
+        (vtk.VTK_TETRA, 4, 4, 0, 3, "apex"),
+        (vtk.VTK_PYRAMID, 5, 4, 1, 4, "apex"),
+        (vtk.VTK_WEDGE, 5, 2, 3, 3, "extrude"),
+        (vtk.VTK_HEXAHEDRON, 6, 0, 6, 4, "extrude"),
+    ]
+
+    def native_cells(self, face_offsets, face_points, face_ids, faces_per_cell, cells_faces_start):
+        # Type VTK natif et points ordonnés à la VTK (complétés par -1), type 0 pour les polyèdres généraux
+        ncells = faces_per_cell.size
+        face_sizes = np.diff(face_offsets)
+        types = np.zeros(ncells, dtype=np.uint8)
+        conn = np.full((ncells, 8), -1, dtype=np.int64)
+
+        for vtk_type, nf, ntri, nquad, nbase, kind in self.SHAPES:
+            candidates = np.where(faces_per_cell == nf)[0]
+            cf = face_ids[cells_faces_start[candidates][:, None] + np.arange(nf)]
+            sz = face_sizes[cf]
+            keep = ((sz == 3).sum(axis=1) == ntri) & ((sz == 4).sum(axis=1) == nquad)
+            candidates, cf, sz = candidates[keep], cf[keep], sz[keep]
+            n = candidates.size
+            if n == 0:
+                continue
+
+            # Faces complétées à 4 points (-1) et arêtes orientées de chaque face
+            m = np.arange(4)
+            valid = m < sz[:, :, None]
+            pts = np.where(valid, face_points[face_offsets[cf][:, :, None] + np.minimum(m, sz[:, :, None] - 1)], -1)
+            nxt = (m + 1) % sz[:, :, None]
+            ends = np.take_along_axis(pts, nxt, axis=2)
+            starts, ends, valid = pts.reshape(n, -1), ends.reshape(n, -1), valid.reshape(n, -1)
+
+            base_face = (sz == nbase).argmax(axis=1)
+            base = pts[np.arange(n), base_face, :nbase][:, ::-1]
+            in_base = (starts[:, :, None] == base[:, None, :]).any(axis=2)
+            end_in_base = (ends[:, :, None] == base[:, None, :]).any(axis=2)
+
+            # Nombre de points distincts attendu (4, 5, 6 ou 8)
+            sorted_pts = np.sort(starts, axis=1)
+            distinct = (sorted_pts[:, 0] >= 0) + ((np.diff(sorted_pts, axis=1) != 0) & (sorted_pts[:, 1:] >= 0)).sum(axis=1)
+            npts = nbase + 1 if kind == "apex" else 2*nbase
+            ok = distinct == npts
+
+            if kind == "apex":
+                others = valid & ~in_base
+                apex = np.where(others, starts, -1).max(axis=1)
+                ok &= np.where(others, starts, apex[:, None]).min(axis=1) == apex
+                shape = np.concatenate((base, apex[:, None]), axis=1)
+            else:
+                top = np.empty_like(base)
+                for k in range(nbase):
+                    mask = valid & (starts == base[:, k:k+1]) & ~end_in_base
+                    ok &= mask.sum(axis=1) == 1
+                    top[:, k] = ends[np.arange(n), mask.argmax(axis=1)]
+                shape = np.concatenate((base, top), axis=1)
+
+            types[candidates[ok]] = vtk_type
+            conn[candidates[ok], :npts] = shape[ok]
+        return types, conn
+
+    def id_cell_array(self, offsets, connectivity):
+        cells = vtk.vtkCellArray()
+        cells.SetData(numpy_support.numpy_to_vtk(np.asarray(offsets, dtype=np.int64), deep=1, array_type=vtk.VTK_ID_TYPE),
+                      numpy_support.numpy_to_vtk(np.asarray(connectivity, dtype=np.int64), deep=1, array_type=vtk.VTK_ID_TYPE))
+        return cells
+
+    def build_unstructured_grid(self, mesh):
+
+        ncells = mesh["ncells"]
+        face_offsets, face_points, face_ids, faces_per_cell = self.cell_faces(mesh)
+        cells_faces_start = np.concatenate(([0], np.cumsum(faces_per_cell)))
+
+        types, shapes = self.native_cells(face_offsets, face_points, face_ids, faces_per_cell, cells_faces_start)
+        is_native = types > 0
+        poly = np.where(~is_native)[0]
+
+        # Points distincts de chaque polyèdre
+        npts = mesh["points"].shape[0]
+        poly_faces = np.repeat(~is_native, faces_per_cell)
+        pf = face_ids[poly_faces]
+        pf_cell = np.repeat(np.arange(ncells), faces_per_cell)[poly_faces]
+        sizes = np.diff(face_offsets)[pf]
+        elem = np.repeat(face_offsets[pf], sizes) + (np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes))
+        pairs = np.unique(np.repeat(pf_cell, sizes) * npts + face_points[elem])
+        poly_points = pairs % npts
+        poly_npts = np.bincount(pairs // npts, minlength=ncells)[poly]
+
+        # Connectivité : points ordonnés des cellules natives, points distincts par polyèdre
+        cell_sizes = (shapes >= 0).sum(axis=1)
+        cell_sizes[poly] = poly_npts
+        cell_offsets = np.concatenate(([0], np.cumsum(cell_sizes)))
+        connectivity = np.empty(cell_offsets[-1], dtype=np.int64)
+        native_shapes = shapes[is_native]
+        connectivity[np.repeat(is_native, cell_sizes)] = native_shapes[native_shapes >= 0]
+        connectivity[np.repeat(~is_native, cell_sizes)] = poly_points
+
+        # Faces des polyèdres uniquement (listes vides pour les cellules natives)
+        poly_face_counts = np.where(is_native, 0, faces_per_cell)
+        used_faces, face_index = np.unique(pf, return_inverse=True)
+        used_sizes = np.diff(face_offsets)[used_faces]
+        used_elem = np.repeat(face_offsets[used_faces], used_sizes) + (np.arange(used_sizes.sum()) - np.repeat(np.cumsum(used_sizes) - used_sizes, used_sizes))
+
+        types = np.where(is_native, types, vtk.VTK_POLYHEDRON).astype(np.uint8)
+        cell_types = numpy_support.numpy_to_vtk(types, deep=1, array_type=vtk.VTK_UNSIGNED_CHAR)
+
+        ug = vtk.vtkUnstructuredGrid()
+        points = vtk.vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(mesh["points"]), deep=1))
+        ug.SetPoints(points)
+        ug.SetPolyhedralCells(
+            cell_types,
+            self.id_cell_array(cell_offsets, connectivity),
+            self.id_cell_array(np.concatenate(([0], np.cumsum(poly_face_counts))), face_index),
+            self.id_cell_array(np.concatenate(([0], np.cumsum(used_sizes))), face_points[used_elem]))
+        return ug
+
+    def add_cell_fields(self, ugrid, fields):
+
+        for name, values in fields.items():
+            arr = numpy_support.numpy_to_vtk(np.ascontiguousarray(values, dtype=np.float64), deep=1)
+            arr.SetName(name)
+            ugrid.GetCellData().AddArray(arr)
+        return ugrid
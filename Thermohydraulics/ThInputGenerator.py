@@ -3,7 +3,9 @@ import sys
 import shutil
 import time
 import subprocess
+import signal
 import re
+from Coupling.SolverMonitor import SolverMonitor
 
 __all__ = ["ThInputGenerator"]
 
@@ -12,6 +14,19 @@ class ThInputGenerator:
     def __init__(self):
 
         #Parameters
+        self.parallel = False #Calcul décomposé : decomposePar, mpirun, reconstructPar
+        self._nprocs = 0 #Nombre de sous-domaines, 0 = cœurs disponibles
+        self.reconstruct_fields = ["T", "rho_post"] #Champs lus par ThOutputReader
+        self.warm_start = False #Champs initiaux = derniers champs de l'itération précédente
+        self._warm_end_time = 500 #Itérations SIMPLE d'un calcul démarré à chaud
+        self.residual_tolerances = {} #Arrêt anticipé : résidu initial maximal par champ, ex. {"h": 1e-6}
+        self.monitor_tolerances = {} #Arrêt anticipé : variation maximale sur la fenêtre, ex. {"T_outlet": 0.01}
+        self._stop_window = 20 #Pas de temps consécutifs sous les tolérances avant l'arrêt
+        self.link_template = True #Maillage et dictionnaires figés liés (hard link) au gabarit au lieu d'être copiés
+        self.mutable_paths = ["0", "case.foam", os.path.join("system", "controlDict"),
+                              os.path.join("system", "decomposeParDict"),
+                              os.path.join("system", "fvOptions")] #Copiés : modifiés à chaque itération
+
         #Variables
         self._iteration = 0
         self._casename = "default"
@@ -32,10 +47,52 @@ class ThInputGenerator:
     def casename(self, value):
         self._casename = value
 
+    @property
+    def nprocs(self):
+        if self._nprocs == 0:
+            return len(os.sched_getaffinity(0))
+        return self._nprocs
+
+    @nprocs.setter
+    def nprocs(self, value):
+        if value < 0:
+            raise ValueError("nprocs must be >= 0")
+        self._nprocs = value
+
+    @property
+    def warm_end_time(self):
+        return self._warm_end_time
+
+    @warm_end_time.setter
+    def warm_end_time(self, value):
+        if value <= 0:
+            raise ValueError("warm_end_time must be > 0")
+        self._warm_end_time = value
+
+    @property
+    def stop_window(self):
+        return self._stop_window
+
+    @stop_window.setter
+    def stop_window(self, value):
+        if value < 1:
+            raise ValueError("stop_window must be >= 1")
+        self._stop_window = value
+
+    @property
+    def previous_results_dir(self):
+        return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration-1), "Thermohydraulics")
+
     @property
     def results_dir(self):
         return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "Thermohydraulics")
 
+    @property
+    def template_dir(self):
+        if self.iteration == 0:
+            return os.path.join(os.getcwd(), "Thermohydraulics", "buoyantSimple_PWR_1st_iteration")
+        return os.path.join(os.getcwd(), "Thermohydraulics", "buoyantSimple_PWR_next_iteration")
+
 
     def main(self):
 
@@ -48,9 +105,11 @@ class ThInputGenerator:
         print("TH iteration:", iteration)
         print("Copie des fichiers de référence en cours.")
         self.copy_reference(results_dir, iteration)
-        #if iteration != 0 :
-            #self.copy_last_timestep(results_dir, iteration, casename)
-            #self.change_startfrom(results_dir)
+        if self.warm_start and iteration != 0 and os.path.isdir(self.previous_results_dir):
+            print("Démarrage à chaud depuis les champs de l'itération précédente")
+            self.copy_last_timestep(results_dir, iteration, casename)
+            self.change_startfrom(results_dir)
+            self.change_endtime(results_dir, self.warm_end_time)
         print("Calcul TH en cours...")
         self.run_simulation(results_dir)
 
@@ -59,11 +118,46 @@ class ThInputGenerator:
 
     def copy_reference(self, results_dir, iteration):
 
-        if iteration == 0:
-            src_dir = os.path.join(os.getcwd(), "Thermohydraulics", "buoyantSimple_PWR_1st_iteration")
-        else:
-            src_dir = os.path.join(os.getcwd(), "Thermohydraulics", "buoyantSimple_PWR_next_iteration")
-        shutil.copytree(src_dir, results_dir)
+        # Un cas existant (calcul interrompu ou relancé) est remplacé par une copie propre
+        if os.path.isdir(results_dir):
+            shutil.rmtree(results_dir)
+        if not self.link_template:
+            shutil.copytree(self.template_dir, results_dir)
+            return
+        # Le gabarit (avec son constant/polyMesh) est le cas maillé canonique : seuls les fichiers
+        # modifiés par itération (mutable_paths) sont copiés, les autres partagent l'inode du gabarit.
+        # Supposés en lecture seule : constant/polyMesh, les dictionnaires de constant/ et de system/
+        # hors mutable_paths (fvSchemes, fvSolution, blockMeshDict, snappyHexMeshDict, createPatchDict,
+        # setFieldsDict, refinementRegionsDict, searchableCylinderDict). Aucun outil de maillage ou de
+        # renumérotation ne doit tourner dans un cas lié : link_template = False dans ce cas.
+        # Les fichiers réécrits par ce module passent de toute façon par detach_template.
+        shutil.copytree(self.template_dir, results_dir, copy_function=self.link_or_copy,
+                        ignore=lambda d, names: [n for n in names if os.path.isdir(os.path.join(d, n))
+                                                 and re.fullmatch(r"processor\d+", n)])
+
+    def link_or_copy(self, src, dst):
+
+        rel_path = os.path.relpath(src, self.template_dir)
+        if not any(rel_path == path or rel_path.startswith(path + os.sep) for path in self.mutable_paths):
+            try:
+                os.link(src, dst)
+                return dst
+            except OSError:
+                pass #Autre système de fichiers : copie
+        return shutil.copy2(src, dst)
+
+    def detach_template(self, path):
+        # Fichier encore lié au gabarit (hard link) : remplacé par une copie avant toute écriture en place
+        if os.path.exists(path) and os.stat(path).st_nlink > 1:
+            tmp_path = path + ".tmp"
+            shutil.copy2(path, tmp_path)
+            os.replace(tmp_path, path)
+
+    def replace_file(self, src, dst):
+        # Écrasement sans écrire dans l'inode existant (éventuellement partagé avec le gabarit)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        return shutil.copy2(src, dst)
 
     def copy_last_timestep(self, results_dir, iteration, casename):
 
@@ -81,9 +175,12 @@ class ThInputGenerator:
 
         previous_dir = os.path.join(previous_timestep_dir, last_timestep_dir)
 
-        new_dir = os.path.join(results_dir, last_timestep_dir)
+        # Champs renumérotés au temps 0 (U, p_rgh, p, T, k, epsilon, nut, alphat, phi...) :
+        # le calcul repart de 0 avec un endTime réduit. uniform/ porte l'ancien temps, on l'écarte.
+        new_dir = os.path.join(results_dir, "0")
 
-        shutil.copytree(previous_dir, new_dir, dirs_exist_ok=True)
+        shutil.copytree(previous_dir, new_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns("uniform"),
+                        copy_function=self.replace_file)
 
     def change_startfrom(self, results_dir):
 
@@ -99,13 +196,97 @@ class ThInputGenerator:
 
         to_modify[target_line - 1] = "startFrom       latestTime;\n"
 
+        self.detach_template(controldict_path)
         with open(controldict_path, "w") as file:
             file.writelines(to_modify)
                            
 
+    def change_endtime(self, results_dir, end_time):
+
+        controldict_path = os.path.join(results_dir, "system", "controlDict")
+
+        with open(controldict_path, "r") as file:
+            content = file.read()
+
+        content = re.sub(r"^endTime\s+[^;]+;", f"endTime         {end_time};", content, flags=re.M)
+
+        self.detach_template(controldict_path)
+        with open(controldict_path, "w") as file:
+            file.write(content)
+
+    def change_stopat(self, results_dir, stop_at):
+        # Relu en cours de calcul (runTimeModifiable true)
+        controldict_path = os.path.join(results_dir, "system", "controlDict")
+
+        with open(controldict_path, "r") as file:
+            content = file.read()
+
+        content = re.sub(r"^stopAt\s+[^;]+;", f"stopAt          {stop_at};", content, flags=re.M)
+
+        # Remplacement atomique : le solveur ne relit jamais un controlDict tronqué ou partiel
+        # (et le lien éventuel avec le gabarit est rompu par le nouveau fichier)
+        tmp_path = controldict_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, controldict_path)
+
+    def run_solver(self, command, results_dir):
+        # Journal du solveur suivi en continu (copie dans log.buoyantSimpleFoam) ;
+        # arrêt par stopAt writeNow dès que les tolérances tiennent sur stop_window pas
+        monitor = SolverMonitor(self.residual_tolerances, self.monitor_tolerances, self.stop_window)
+        stopped = False
+
+        with open(os.path.join(results_dir, "log.buoyantSimpleFoam"), "w") as log:
+            process = subprocess.Popen(command, cwd=results_dir, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, text=True, bufsize=1, start_new_session=True)
+            try:
+                for line in process.stdout:
+                    log.write(line)
+                    if monitor.feed(line) and not stopped and monitor.converged():
+                        print(f"Calcul TH stationnaire au temps {monitor.history[-1]['time']:g}, arrêt anticipé")
+                        self.change_stopat(results_dir, "writeNow")
+                        stopped = True
+                process.wait()
+            finally:
+                # Exception ou interruption : tout le groupe (mpirun et ses rangs) est tué, pas d'orphelin
+                if process.poll() is None:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait()
+
+        monitor.write(os.path.join(results_dir, "residuals.bin"))
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+    def set_subdomains(self, results_dir, n):
+
+        decompose_path = os.path.join(results_dir, "system", "decomposeParDict")
+
+        with open(decompose_path, "r") as file:
+            content = file.read()
+
+        content = re.sub(r"numberOfSubdomains\s+\d+;", f"numberOfSubdomains {n};", content)
+
+        self.detach_template(decompose_path)
+        with open(decompose_path, "w") as file:
+            file.write(content)
+
     def run_simulation(self, results_dir):
 
-        subprocess.run(["buoyantSimpleFoam"], cwd=results_dir)
+        n = self.nprocs
+        if not self.parallel or n < 2:
+            self.run_solver(["buoyantSimpleFoam"], results_dir)
+            return
+
+        print(f"Calcul TH décomposé sur {n} processus")
+        self.set_subdomains(results_dir, n)
+        subprocess.run(["decomposePar", "-force"], cwd=results_dir, check=True)
+        self.run_solver(["mpirun", "-np", str(n), "buoyantSimpleFoam", "-parallel"], results_dir)
+        if self.warm_start:
+            # L'itération suivante repart de tous les champs du dernier temps
+            subprocess.run(["reconstructPar", "-latestTime"], cwd=results_dir, check=True)
+        else:
+            subprocess.run(["reconstructPar", "-latestTime", "-fields", f"({' '.join(self.reconstruct_fields)})"],
+                           cwd=results_dir, check=True)
 
 if __name__ == "__main__":
     try:
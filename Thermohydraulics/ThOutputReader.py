@@ -2,14 +2,29 @@ import os
 import sys
 import subprocess
 import numpy as np
-import pandas as pd
 import vtk
+from vtk.util import numpy_support
 import time
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import re
+import hashlib
+import multiprocessing
+from Thermohydraulics.FoamReader import FoamReader
+from Coupling.FieldExchange import FieldExchange
+from Coupling.ThField import ThField
+from Coupling.PostProcessor import PostProcessor
 
 __all__ = ["ThOutputReader"]
 
+# État partagé avec les processus du pool : hérité par fork, jamais sérialisé
+_shared = {}
+
+def _sample_slab(task):
+    j, stream = task
+    reader, probe, args, reduce = _shared["reader"], _shared["probe"], _shared["args"], _shared["reduce"]
+    sl, cid = reader.slab_cells(probe, *args, j, np.random.default_rng(stream))
+    return reduce(sl, cid)
+
 class ThOutputReader:
 
     def __init__(self):
@@ -25,10 +40,17 @@ class ThOutputReader:
         self.nz = 24
         self.mc_samples_per_voxel = 5000
         self.seed = 42
+        self.use_weights_cache = True
+        self.native_reader = True
+        self.write_csv = False #Export texte TH_output.csv en plus du binaire
+        self.async_write = False #Écriture des fichiers en arrière-plan, champs renvoyés par main()
+        self.post = PostProcessor() #Figures exécutées sur place sauf si MainCoupling fournit sa file
 
         #Variables
         self._iteration = 0
         self._casename = "default"
+        self._remap_method = "monte_carlo"
+        self._mc_workers = 0 #0 : tirage séquentiel historique, N >= 1 : un flux aléatoire par tranche sur N processus
 
     @property
     def iteration(self):
@@ -46,14 +68,42 @@ class ThOutputReader:
     def casename(self, value):
         self._casename = value
 
+    @property
+    def remap_method(self):
+        return self._remap_method
+
+    @remap_method.setter
+    def remap_method(self, value):
+        if value not in ("monte_carlo", "overlap"):
+            raise ValueError("remap_method must be 'monte_carlo' or 'overlap'")
+        self._remap_method = value
+
+    @property
+    def mc_workers(self):
+        return self._mc_workers
+
+    @mc_workers.setter
+    def mc_workers(self, value):
+        if value < 0:
+            raise ValueError("mc_workers must be >= 0")
+        self._mc_workers = value
+
     @property
     def results_dir(self):
         return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "Thermohydraulics")
     
     @property
     def output_dir(self):
+        return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "TH_output.bin")
+
+    @property
+    def csv_output_dir(self):
         return os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "TH_output.csv")
 
+    @property
+    def weights_path(self):
+        return os.path.join(os.getcwd(), "Results", self.casename, f"voxel_weights_{self.remap_method}.npz")
+
 
     def main(self):
 
@@ -65,25 +115,39 @@ class ThOutputReader:
         output_dir = self.output_dir
         bounds = (self.xmin, self.xmax, self.ymin, self.ymax, self.zmin, self.zmax)
 
-        self.export_openfoam_to_vtk(results_dir)
-        vtu_path = self.find_latest_vtu(results_dir)
-        ug = self.read_unstructured_grid(vtu_path)
+        if self.native_reader:
+            ug = self.read_openfoam_case(results_dir)
+        else:
+            self.export_openfoam_to_vtk(results_dir)
+            vtu_path = self.find_latest_vtu(results_dir)
+            ug = self.read_unstructured_grid(vtu_path)
         
-        ix, iy, iz, Tavg, Ravg, extras = self.monte_carlo_voxel_average(
+        if self.remap_method == "monte_carlo" and not self.use_weights_cache:
+            voxel_average = self.monte_carlo_voxel_average
+        else:
+            voxel_average = self.weighted_voxel_average
+
+        ix, iy, iz, Tavg, Ravg, extras = voxel_average(
             ug, bounds, self.nx, self.ny, self.nz,
             self.mc_samples_per_voxel, self.seed) 
         
         data = {"ix": ix, "iy": iy, "iz": iz,   
                 "T": Tavg, "rho" : Ravg,
-                "valid": extras["valid"]}
+                **extras}
         
-        df = pd.DataFrame(data)
-        df.to_csv(output_dir, index=False, float_format="%.8f")
-        self.output_plot(self.nz, output_dir)
-        print(f"Écriture de {output_dir} finie.")
+        if self.async_write:
+            FieldExchange().write_async(output_dir, data, self.csv_output_dir if self.write_csv else None)
+        else:
+            FieldExchange().write(output_dir, data)
+            if self.write_csv:
+                FieldExchange().write_csv(self.csv_output_dir, data)
+        plot_path = os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration), "Z water temperature plot")
+        self.post.submit(self.output_plot, self.nz, ThField.from_columns(data), plot_path, iteration=self.iteration)
+        print(f"Écriture de {output_dir} lancée." if self.async_write else f"Écriture de {output_dir} finie.")
 
         end=time.time()
         print(f"Lecture des résultats TH en {round(end-start, 0)}s")
+        return data
 
 
     def export_openfoam_to_vtk(self, results_dir):
@@ -111,32 +175,28 @@ class ThOutputReader:
         ug = r.GetOutput()
         return ug
 
-    def output_plot(self, NN, output_dir):
+    def read_openfoam_case(self, results_dir):
+        # Maillage et champs lus directement, sans postProcess / foamToVTK ni écriture du VTU
+        reader = FoamReader()
+        mesh = reader.read_mesh(results_dir)
+        fields = reader.read_fields(results_dir, ["T", "rho_post"], mesh["ncells"])
+        ug = reader.build_unstructured_grid(mesh)
+        return reader.add_cell_fields(ug, fields)
 
-        water_data = {}
-        datas = pd.read_csv(output_dir, usecols=["ix", "iy", "iz", "T", "rho", "valid"])
+    def output_plot(self, NN, water_data, plot_path):
+        # Figure propre à l'appel (API objet, sans état pyplot) : utilisable depuis un thread
+        z_values = np.arange(1, NN+1)  
+        z_list = water_data.axial_mean("T", nx=17, ny=17)[:NN]
 
-        for _, row in datas.iterrows():
-            x , y, z = row["ix"], row["iy"], row["iz"]
-            water_data.setdefault(x, {}).setdefault(y, {})[z] = {col: row[col] for col in datas.columns if col not in ("x", "y", "z")}
+        fig = Figure()
+        ax = fig.add_subplot()
+        ax.plot(z_values, z_list, marker="o", linestyle="-")
 
-        z_values = np.arange(1, NN+1)  
-        z_list = []
-        for z in range (1, NN+1):
-            xy_list = []
-            for y in range(1, 18):
-                for x in range(1, 18):
-                    xy_list.append(water_data[x][y][z]["T"])
-            z_list.append(np.mean(xy_list))
-            xy_list.clear()
-
-        plt.plot(z_values, z_list, marker="o", linestyle="-")
-
-        plt.xlabel("Nodes")
-        plt.ylabel("Temperature in Kelvins")
-        plt.title("Temperature for the node")
-        plt.grid(True)
-        plt.savefig(os.path.join(os.getcwd(), "Results", self.casename, str(self.iteration),"Z water temperature plot"), dpi=300, bbox_inches="tight")
+        ax.set_xlabel("Nodes")
+        ax.set_ylabel("Temperature in Kelvins")
+        ax.set_title("Temperature for the node")
+        ax.grid(True)
+        fig.savefig(plot_path, dpi=300, bbox_inches="tight")
         print("Water temperature plot created")
     
     # Méthode Monte-Carlo 
@@ -162,68 +222,359 @@ class ThOutputReader:
         r[:,2] = z0 + (z1 - z0)*r[:,2]
         return r
 
-    def extract_cell_scalar_getter(self, ugrid, name):
+    def random_voxel_points(self, x0, x1, y0, y1, z0, z1, n, rng=None):
+        # Même tirage que random_points, enchaîné sur une série de voxels : (nvox, n, 3)
+        x0, x1, y0, y1, z0, z1 = np.broadcast_arrays(x0, x1, y0, y1, z0, z1)
+        r = np.random.rand(x0.size, n, 3) if rng is None else rng.random((x0.size, n, 3))
+        r[:,:,0] = x0[:,None] + (x1 - x0)[:,None]*r[:,:,0]
+        r[:,:,1] = y0[:,None] + (y1 - y0)[:,None]*r[:,:,1]
+        r[:,:,2] = z0[:,None] + (z1 - z0)[:,None]*r[:,:,2]
+        return r
+
+    def extract_cell_scalar_array(self, ugrid, name):
         arr = ugrid.GetCellData().GetArray(name)
         if arr is None:
             raise RuntimeError(f"Champ CellData '{name}' introuvable dans le VTU.")
-        def get_val(cid):
-            return arr.GetTuple1(cid)
-        return get_val
+        return numpy_support.vtk_to_numpy(arr).astype(np.float64)
+
+    def cell_id_source(self, ugrid):
+        # Source allégée : seul l'indice de cellule est transporté, T et rho sont lus par indexation
+        source = vtk.vtkUnstructuredGrid()
+        source.ShallowCopy(ugrid)
+        source.GetPointData().Initialize()
+        source.GetCellData().Initialize()
+        cell_ids = numpy_support.numpy_to_vtk(np.arange(ugrid.GetNumberOfCells()), deep=1, array_type=vtk.VTK_ID_TYPE)
+        cell_ids.SetName("cell_id")
+        source.GetCellData().AddArray(cell_ids)
+        return source
+
+    # Permutations du prisme plaçant le sommet d'indice global minimal en position 0
+    WEDGE_ROTATIONS = np.array([[0, 1, 2, 3, 4, 5], [1, 2, 0, 4, 5, 3], [2, 0, 1, 5, 3, 4],
+                                [3, 4, 5, 0, 1, 2], [4, 5, 3, 1, 2, 0], [5, 3, 4, 2, 0, 1]])
+
+    def cell_types(self, ugrid):
+        types = ugrid.GetCellTypes() if vtk.vtkVersion.GetVTKMajorVersion() * 100 + vtk.vtkVersion.GetVTKMinorVersion() >= 906 \
+            else ugrid.GetCellTypesArray()
+        return numpy_support.vtk_to_numpy(types)
+
+    def wedge_tetrahedra(self, ugrid):
+        # Prismes découpés en 3 tétraèdres (diagonale issue du plus petit sommet de chaque face
+        # quadrangulaire, découpage conforme entre voisins) : le test de contenance des VTK_WEDGE
+        # accepte des points hors du prisme (r + s > 1), celui des tétraèdres est exact
+        types = self.cell_types(ugrid)
+        wedges = np.where(types == vtk.VTK_WEDGE)[0]
+        cells = ugrid.GetCells()
+        offsets = numpy_support.vtk_to_numpy(cells.GetOffsetsArray())
+        connectivity = numpy_support.vtk_to_numpy(cells.GetConnectivityArray())
+        w = connectivity[offsets[wedges][:, None] + np.arange(6)]
+
+        v = np.take_along_axis(w, self.WEDGE_ROTATIONS[w.argmin(axis=1)], axis=1)
+        diag15 = (np.minimum(v[:, 1], v[:, 5]) < np.minimum(v[:, 2], v[:, 4]))[:, None]
+        tets = np.stack((
+            np.where(diag15, v[:, [0, 1, 2, 5]], v[:, [0, 1, 2, 4]]),
+            np.where(diag15, v[:, [0, 1, 5, 4]], v[:, [0, 4, 2, 5]]),
+            v[:, [0, 4, 5, 3]]), axis=1).reshape(-1, 4)
+        return wedges, tets
+
+    def probe_source(self, ugrid):
+        # Source du probe : indice de cellule d'origine porté par chaque morceau
+        source = self.cell_id_source(ugrid)
+        wedges, tets = self.wedge_tetrahedra(ugrid)
+        if wedges.size == 0:
+            return source
+
+        others = vtk.vtkExtractCellsByType()
+        others.SetInputData(source)
+        for cell_type in np.unique(self.cell_types(ugrid)):
+            if cell_type != vtk.VTK_WEDGE:
+                others.AddCellType(int(cell_type))
+        others.Update()
+
+        pieces = vtk.vtkUnstructuredGrid()
+        pieces.SetPoints(ugrid.GetPoints())
+        cells = vtk.vtkCellArray()
+        cells.SetData(numpy_support.numpy_to_vtk(np.arange(0, tets.size + 1, 4, dtype=np.int64), deep=1, array_type=vtk.VTK_ID_TYPE),
+                      numpy_support.numpy_to_vtk(tets.ravel().astype(np.int64), deep=1, array_type=vtk.VTK_ID_TYPE))
+        pieces.SetCells(vtk.VTK_TETRA, cells)
+        cell_ids = numpy_support.numpy_to_vtk(np.repeat(wedges, 3), deep=1, array_type=vtk.VTK_ID_TYPE)
+        cell_ids.SetName("cell_id")
+        pieces.GetCellData().AddArray(cell_ids)
+
+        append = vtk.vtkAppendFilter()
+        append.AddInputData(others.GetOutput())
+        append.AddInputData(pieces)
+        append.Update()
+        return append.GetOutput()
+
+    def build_cell_probe(self, ugrid):
+        source = self.probe_source(ugrid)
 
-    def monte_carlo_voxel_average(self, ugrid, bounds, nx, ny, nz,
-                                samples_per_voxel, seed): 
-        
-        np.random.seed(seed) 
+        locator = vtk.vtkStaticCellLocator()
+        locator.SetDataSet(source)
+        locator.BuildLocator()
 
+        probe = vtk.vtkProbeFilter()
+        probe.SetSourceData(source)
+        probe.SetCellLocator(locator)
+        probe.ComputeToleranceOff()
+        probe.SetTolerance(0.0)
+        return probe
+
+    def locate_cells(self, probe, pts):
+        # Test de contenance strict (tolérance nulle, prismes en tétraèdres). FindCell appelé point
+        # par point sur la grille d'origine accepte en plus les faux positifs des VTK_WEDGE :
+        # les deux chemins ne coïncident que sur les maillages sans prisme
+        pts = np.ascontiguousarray(pts, dtype=np.float64)
+        points = vtk.vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(pts))
+        polydata = vtk.vtkPolyData()
+        polydata.SetPoints(points)
+
+        probe.SetInputData(polydata)
+        probe.Update()
+        out = probe.GetOutput().GetPointData()
+        cid = numpy_support.vtk_to_numpy(out.GetArray("cell_id")).astype(np.int64)
+        mask = numpy_support.vtk_to_numpy(out.GetArray(probe.GetValidPointMaskArrayName()))
+        cid[mask == 0] = -1  # -1 si hors maillage
+        return cid
+
+    def voxel_indices(self, nx, ny, nz):
+        # Ordre de sortie des voxels : boucle j > i > k
+        IX = np.tile(np.repeat(np.arange(1, nx+1), nz), ny)
+        IY = np.repeat(np.arange(1, ny+1), nx*nz)
+        IZ = np.tile(np.arange(1, nz+1), nx*ny)
+        return IX, IY, IZ
+
+    def slab_cells(self, probe, bounds, nx, ny, nz, samples_per_voxel, j, rng=None):
+        # Tranche j : voxels ordonnés (i, k) comme la boucle j > i > k d'origine
         origin, spacing = self.build_image_grid(bounds, nx, ny, nz)
+        nslab = nx * nz
+        sl = slice((j-1)*nslab, j*nslab)
+        i_slab = np.repeat(np.arange(1, nx+1), nz)
+        k_slab = np.tile(np.arange(1, nz+1), nx)
+
+        x0,x1,y0,y1,z0,z1 = self.voxel_bounds(origin, spacing, i_slab, j, k_slab)
+        pts = self.random_voxel_points(x0, x1, y0, y1, z0, z1, samples_per_voxel, rng)
+        cid = self.locate_cells(probe, pts.reshape(-1, 3)).reshape(nslab, samples_per_voxel)
+        return sl, cid
+
+    def map_voxel_slabs(self, probe, bounds, nx, ny, nz, samples_per_voxel, seed, reduce):
+        # Applique reduce(sl, cid) à chaque tranche j, résultats dans l'ordre des tranches
+        args = (bounds, nx, ny, nz, samples_per_voxel)
+
+        if self.mc_workers == 0:
+            np.random.seed(seed)
+            return [reduce(*self.slab_cells(probe, *args, j)) for j in range(1, ny+1)]
+
+        # Flux indépendants dérivés de seed : résultat identique quel que soit le nombre de processus
+        streams = np.random.SeedSequence(seed).spawn(ny)
+        tasks = list(zip(range(1, ny+1), streams))
+        _shared.update(reader=self, probe=probe, args=args, reduce=reduce)
+        try:
+            if self.mc_workers == 1:
+                return [_sample_slab(task) for task in tasks]
+            # fork d'un processus multi-thread : écritures asynchrones terminées avant, aucun verrou
+            # d'E/S hérité par les enfants. Les figures ne sont pas attendues : les enfants ne
+            # touchent qu'à numpy et VTK, que les threads de post-traitement n'utilisent pas
+            FieldExchange().flush()
+            with multiprocessing.get_context("fork").Pool(self.mc_workers) as pool:
+                return pool.map(_sample_slab, tasks, chunksize=1)
+        finally:
+            _shared.clear()
+
+    def monte_carlo_voxel_average(self, ugrid, bounds, nx, ny, nz,
+                                samples_per_voxel, seed): 
 
         ncell = nx * ny * nz
-        IX = np.empty(ncell, dtype=np.int64)
-        IY = np.empty(ncell, dtype=np.int64)
-        IZ = np.empty(ncell, dtype=np.int64)
+        IX, IY, IZ = self.voxel_indices(nx, ny, nz)
         Tm = np.full(ncell, np.nan)
         Rm = np.full(ncell, np.nan)
         valid = np.zeros(ncell, dtype=np.int32)
 
-        get_T = self.extract_cell_scalar_getter(ugrid, "T")
-        get_R = self.extract_cell_scalar_getter(ugrid, "rho_post")
+        T = self.extract_cell_scalar_array(ugrid, "T")
+        R = self.extract_cell_scalar_array(ugrid, "rho_post")
+        probe = self.build_cell_probe(ugrid)
 
-        locator = vtk.vtkStaticCellLocator()
-        locator.SetDataSet(ugrid)
-        locator.BuildLocator()
+        def reduce(sl, cid):
+            inside = cid >= 0
+            # cumsum somme dans l'ordre des tirages : mêmes arrondis que l'accumulation échantillon par échantillon
+            tsum = np.where(inside, T[cid], 0.0).cumsum(axis=1)[:, -1]
+            rsum = np.where(inside, R[cid], 0.0).cumsum(axis=1)[:, -1]
+            return sl, tsum, rsum, inside.sum(axis=1)
 
-        idx = 0
-        for j in range(1, ny+1):          
-            for i in range(1, nx+1):      
-                for k in range(1, nz+1):  
-                    ix = i
-                    iy = j
-                    iz = k
-                    IX[idx], IY[idx], IZ[idx] = ix, iy, iz
-
-                    x0,x1,y0,y1,z0,z1 = self.voxel_bounds(origin, spacing, i, j, k)
-                    pts = self.random_points(x0, x1, y0, y1, z0, z1, samples_per_voxel)
-
-                    rsum = 0.0
-                    tsum = 0.0
-                    cnt = 0
-                    for p in pts:
-                        cid = locator.FindCell(p.tolist())  # -1 si hors maillage
-                        if cid >= 0:
-                            tsum += get_T(cid)
-                            rsum += get_R(cid)
-                            cnt += 1
-
-                    if cnt > 0:
-                        Tm[idx] = tsum / cnt
-                        Rm[idx] = rsum / cnt
-                        valid[idx] = cnt
-
-                    idx += 1
+        for sl, tsum, rsum, cnt in self.map_voxel_slabs(probe, bounds, nx, ny, nz, samples_per_voxel, seed, reduce):
+            hit = cnt > 0
+            Tm[sl][hit] = tsum[hit] / cnt[hit]
+            Rm[sl][hit] = rsum[hit] / cnt[hit]
+            valid[sl] = cnt
 
         extras = {"valid": valid}
         return IX, IY, IZ, Tm, Rm, extras
 
+    # Opérateur de remappage voxel <- cellule mis en cache
+
+    def mesh_hash(self, ugrid):
+        h = hashlib.sha1()
+        cells = ugrid.GetCells()
+        for arr in (ugrid.GetPoints().GetData(), cells.GetOffsetsArray(), cells.GetConnectivityArray()):
+            h.update(np.ascontiguousarray(numpy_support.vtk_to_numpy(arr)).tobytes())
+        return h.hexdigest()
+
+    def weights_key(self, ugrid, bounds, nx, ny, nz, samples_per_voxel, seed):
+        params = (self.remap_method, tuple(float(b) for b in bounds), nx, ny, nz)
+        if self.remap_method == "monte_carlo":
+            params += (samples_per_voxel, seed, self.mc_workers > 0, "wedge_tetrahedra")
+        return hashlib.sha1((self.mesh_hash(ugrid) + repr(params)).encode()).hexdigest()
+
+    def build_voxel_weights(self, ugrid, bounds, nx, ny, nz, samples_per_voxel, seed):
+        # Matrice creuse au format COO : W[row, col] = counts / valid[row]
+        ncell = nx * ny * nz
+        ncells_mesh = ugrid.GetNumberOfCells()
+        valid = np.zeros(ncell, dtype=np.int32)
+        rows, cols, counts = [], [], []
+
+        probe = self.build_cell_probe(ugrid)
+
+        def reduce(sl, cid):
+            inside = cid >= 0
+            row = np.broadcast_to(np.arange(sl.start, sl.stop)[:, None], cid.shape)
+            pairs, cnt = np.unique(row[inside] * ncells_mesh + cid[inside], return_counts=True)
+            return sl, pairs, cnt, inside.sum(axis=1)
+
+        for sl, pairs, cnt, slab_valid in self.map_voxel_slabs(probe, bounds, nx, ny, nz, samples_per_voxel, seed, reduce):
+            valid[sl] = slab_valid
+            rows.append((pairs // ncells_mesh).astype(np.int32))
+            cols.append((pairs % ncells_mesh).astype(np.int32))
+            counts.append(cnt.astype(np.int32))
+
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(counts), valid
+
+    # Méthode par recouvrement exact cellule ∩ voxel
+
+    def split_dataset(self, ds, axis, coord):
+        origin = [0.0, 0.0, 0.0]
+        normal = [0.0, 0.0, 0.0]
+        origin[axis] = coord
+        normal[axis] = 1.0
+        plane = vtk.vtkPlane()
+        plane.SetOrigin(origin)
+        plane.SetNormal(normal)
+
+        clip = vtk.vtkTableBasedClipDataSet()
+        clip.SetInputData(ds)
+        clip.SetClipFunction(plane)
+        clip.GenerateClippedOutputOn()
+        clip.Update()
+        return clip.GetClippedOutput(), clip.GetOutput()  # (coord inférieure, coord supérieure)
+
+    def cell_volumes(self, ds):
+        sizes = vtk.vtkCellSizeFilter()
+        sizes.SetInputData(ds)
+        sizes.ComputeVertexCountOff()
+        sizes.ComputeLengthOff()
+        sizes.ComputeAreaOff()
+        sizes.ComputeVolumeOn()
+        sizes.Update()
+        return numpy_support.vtk_to_numpy(sizes.GetOutput().GetCellData().GetArray("Volume"))
+
+    def build_overlap_weights(self, ugrid, bounds, nx, ny, nz):
+        # Découpe dichotomique du maillage par les plans de la grille : chaque morceau final
+        # est contenu dans un seul voxel, son volume est le recouvrement cellule ∩ voxel
+        ncell = nx * ny * nz
+        origin, spacing = self.build_image_grid(bounds, nx, ny, nz)
+        rows, cols, volumes = [], [], []
+
+        ds = self.cell_id_source(ugrid)
+        for axis in range(3):
+            ds = self.split_dataset(ds, axis, bounds[2*axis])[1]
+            ds = self.split_dataset(ds, axis, bounds[2*axis+1])[0]
+
+        stack = [(ds, [(0, nx), (0, ny), (0, nz)])]
+        while stack:
+            ds, ranges = stack.pop()
+            if ds.GetNumberOfCells() == 0:
+                continue
+
+            sizes = [hi - lo for lo, hi in ranges]
+            axis = int(np.argmax(sizes))
+            if sizes[axis] == 1:
+                (i, _), (j, _), (k, _) = ranges
+                cid = numpy_support.vtk_to_numpy(ds.GetCellData().GetArray("cell_id"))
+                ids, inverse = np.unique(cid, return_inverse=True)
+                rows.append(np.full(ids.size, j*nx*nz + i*nz + k, dtype=np.int32))
+                cols.append(ids.astype(np.int32))
+                volumes.append(np.bincount(inverse, weights=self.cell_volumes(ds)))
+                continue
+
+            lo, hi = ranges[axis]
+            mid = (lo + hi) // 2
+            below, above = self.split_dataset(ds, axis, origin[axis] + mid*spacing[axis])
+            stack.append((below, ranges[:axis] + [(lo, mid)] + ranges[axis+1:]))
+            stack.append((above, ranges[:axis] + [(mid, hi)] + ranges[axis+1:]))
+
+        rows, cols, volumes = np.concatenate(rows), np.concatenate(cols), np.concatenate(volumes)
+        covered = np.bincount(rows, weights=volumes, minlength=ncell)
+        return rows, cols, volumes, covered
+
+    # Application de l'opérateur creux, avec cache disque
+
+    def load_voxel_weights(self, weights_path, key):
+        if not os.path.exists(weights_path):
+            return None
+        with np.load(weights_path) as f:
+            if str(f["key"]) != key:
+                return None
+            return f["rows"], f["cols"], f["weights"], f["norm"]
+
+    def voxel_weights(self, ugrid, bounds, nx, ny, nz, samples_per_voxel, seed):
+
+        if self.remap_method == "overlap":
+            build = lambda: self.build_overlap_weights(ugrid, bounds, nx, ny, nz)
+        else:
+            build = lambda: self.build_voxel_weights(ugrid, bounds, nx, ny, nz, samples_per_voxel, seed)
+
+        if not self.use_weights_cache:
+            return build()
+
+        weights_path = self.weights_path
+        key = self.weights_key(ugrid, bounds, nx, ny, nz, samples_per_voxel, seed)
+        weights = self.load_voxel_weights(weights_path, key)
+
+        if weights is None:
+            print("Construction de l'opérateur de remappage voxel <- cellule...")
+            weights = build()
+            rows, cols, w, norm = weights
+            os.makedirs(os.path.dirname(weights_path), exist_ok=True)
+            np.savez_compressed(weights_path, key=key, rows=rows, cols=cols, weights=w, norm=norm)
+        else:
+            print(f"Opérateur de remappage relu depuis {weights_path}")
+        return weights
+
+    def apply_voxel_weights(self, weights, values):
+        rows, cols, w, norm = weights
+        sums = np.bincount(rows, weights=w * values[cols], minlength=norm.size)
+        avg = np.full(norm.size, np.nan)
+        hit = norm > 0
+        avg[hit] = sums[hit] / norm[hit]
+        return avg
+
+    def weighted_voxel_average(self, ugrid, bounds, nx, ny, nz,
+                               samples_per_voxel, seed):
+
+        weights = self.voxel_weights(ugrid, bounds, nx, ny, nz, samples_per_voxel, seed)
+
+        IX, IY, IZ = self.voxel_indices(nx, ny, nz)
+        Tm = self.apply_voxel_weights(weights, self.extract_cell_scalar_array(ugrid, "T"))
+        Rm = self.apply_voxel_weights(weights, self.extract_cell_scalar_array(ugrid, "rho_post"))
+
+        norm = weights[3]
+        if self.remap_method == "overlap":
+            _, spacing = self.build_image_grid(bounds, nx, ny, nz)
+            extras = {"covered": norm / np.prod(spacing)}  # fraction du voxel couverte par le maillage
+        else:
+            extras = {"valid": norm}
+        return IX, IY, IZ, Tm, Rm, extras
+
 
 if __name__ == "__main__":
     try:
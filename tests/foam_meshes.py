@@ -0,0 +1,105 @@
+import numpy as np
+import vtk
+
+# Petits maillages polyMesh construits en mémoire (format de FoamReader.read_mesh) :
+# faces, owner, neighbour comme OpenFOAM, faces internes orientées du propriétaire vers le voisin
+
+
+def polymesh(points, cells):
+    # cells : liste de cellules, chacune liste de faces (indices de points) orientées vers l'extérieur
+    shared = {}
+    internal, boundary = [], []
+    for c, faces in enumerate(cells):
+        for face in faces:
+            key = tuple(sorted(face))
+            if key in shared:
+                owner, owner_face = shared.pop(key)
+                internal.append((owner, c, owner_face))
+            else:
+                shared[key] = (c, list(face))
+    boundary = sorted(shared.values(), key=lambda f: f[0])
+    internal.sort(key=lambda f: (f[0], f[1]))
+
+    faces = [f for _, _, f in internal] + [f for _, f in boundary]
+    sizes = np.array([len(f) for f in faces], dtype=np.int64)
+    return {
+        "points": np.asarray(points, dtype=np.float64),
+        "face_offsets": np.concatenate(([0], np.cumsum(sizes))),
+        "face_points": np.array([p for f in faces for p in f], dtype=np.int64),
+        "owner": np.array([o for o, _, _ in internal] + [o for o, _ in boundary], dtype=np.int64),
+        "neighbour": np.array([n for _, n, _ in internal], dtype=np.int64),
+        "ncells": len(cells),
+        "cell_faces": cells,
+    }
+
+
+def extrude(bottom, top):
+    # Faces sortantes d'un prisme droit de base polygonale (bottom dans le sens trigonométrique vu d'en haut)
+    n = len(bottom)
+    faces = [bottom[::-1], list(top)]
+    for m in range(n):
+        faces.append([bottom[m], bottom[(m+1) % n], top[(m+1) % n], top[m]])
+    return faces
+
+
+def extruded_mesh(nx, ny, nz, split=lambda i, j: (i + j) % 2 == 0, jitter=0.0, seed=0, size=(1.0, 1.0, 1.0)):
+    # Grille nx x ny extrudée sur nz couches : colonnes coupées en deux prismes (split) ou hexaèdres.
+    # Le bruit déplace les nœuds intérieurs dans le plan xy : faces planes, cellules non alignées.
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, size[0], nx + 1)
+    y = np.linspace(0.0, size[1], ny + 1)
+    z = np.linspace(0.0, size[2], nz + 1)
+    X, Y = np.meshgrid(x, y, indexing="ij")
+    interior = np.zeros_like(X, dtype=bool)
+    interior[1:-1, 1:-1] = True
+    X = X + np.where(interior, rng.uniform(-jitter, jitter, X.shape) * size[0] / nx, 0.0)
+    Y = Y + np.where(interior, rng.uniform(-jitter, jitter, Y.shape) * size[1] / ny, 0.0)
+
+    layer = (nx + 1) * (ny + 1)
+    points = [(X[i, j], Y[i, j], z[k]) for k in range(nz + 1) for j in range(ny + 1) for i in range(nx + 1)]
+    node = lambda i, j, k: k*layer + j*(nx + 1) + i
+
+    cells = []
+    for k in range(nz):
+        for j in range(ny):
+            for i in range(nx):
+                quad = [(i, j), (i+1, j), (i+1, j+1), (i, j+1)]
+                if split(i, j):
+                    polygons = [[quad[0], quad[1], quad[2]], [quad[0], quad[2], quad[3]]] if (i + j) % 4 == 0 \
+                        else [[quad[0], quad[1], quad[3]], [quad[1], quad[2], quad[3]]]
+                else:
+                    polygons = [quad]
+                for polygon in polygons:
+                    cells.append(extrude([node(a, b, k) for a, b in polygon], [node(a, b, k+1) for a, b in polygon]))
+    return polymesh(points, cells)
+
+
+def single_cell(kind):
+    # Une cellule isolée de chaque forme, volume exact connu
+    if kind == "tet":
+        points = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
+        faces = [[0, 2, 1], [0, 1, 3], [1, 2, 3], [0, 3, 2]]
+        return polymesh(points, [faces]), 1/6
+    if kind == "pyramid":
+        points = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (0.5, 0.5, 1)]
+        faces = [[0, 3, 2, 1], [0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4]]
+        return polymesh(points, [faces]), 1/3
+    if kind == "wedge":
+        points = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 0, 1), (0, 1, 1)]
+        return polymesh(points, [extrude([0, 1, 2], [3, 4, 5])]), 0.5
+    if kind == "hex":
+        points = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)]
+        return polymesh(points, [extrude([0, 1, 2, 3], [4, 5, 6, 7])]), 1.0
+    if kind == "hexagonal_prism":
+        angles = np.arange(6) * np.pi / 3
+        ring = [(np.cos(a), np.sin(a)) for a in angles]
+        points = [(x, y, 0) for x, y in ring] + [(x, y, 1) for x, y in ring]
+        return polymesh(points, [extrude(list(range(6)), list(range(6, 12)))]), 1.5 * np.sqrt(3)
+    raise ValueError(kind)
+
+
+def contains(ugrid, cell_id, point):
+    # Point à l'intérieur de la cellule VTK (EvaluatePosition, tolérance paramétrique de VTK)
+    cell = ugrid.GetCell(cell_id)
+    pcoords, closest, weights = [0.0]*3, [0.0]*3, [0.0]*cell.GetNumberOfPoints()
+    return cell.EvaluatePosition(list(point), closest, vtk.mutable(0), pcoords, vtk.mutable(0.0), weights) == 1
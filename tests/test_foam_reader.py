@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import vtk
+from Thermohydraulics.FoamReader import FoamReader
+from Thermohydraulics.ThOutputReader import ThOutputReader
+from foam_meshes import contains, extruded_mesh, single_cell
+
+
+def cell_volumes(ugrid):
+    return ThOutputReader().cell_volumes(ugrid)
+
+
+@pytest.mark.parametrize("kind, vtk_type", [
+    ("tet", vtk.VTK_TETRA),
+    ("pyramid", vtk.VTK_PYRAMID),
+    ("wedge", vtk.VTK_WEDGE),
+    ("hex", vtk.VTK_HEXAHEDRON),
+    ("hexagonal_prism", vtk.VTK_POLYHEDRON),
+])
+def test_cell_types_and_orientation(kind, vtk_type):
+    mesh, volume = single_cell(kind)
+    ug = FoamReader().build_unstructured_grid(mesh)
+
+    assert ug.GetCellType(0) == vtk_type
+    assert cell_volumes(ug)[0] == pytest.approx(volume)
+    assert contains(ug, 0, mesh["points"].mean(axis=0))
+
+
+def test_mixed_mesh_native_cells():
+    mesh = extruded_mesh(5, 4, 3, jitter=0.3, seed=3)
+    ug = FoamReader().build_unstructured_grid(mesh)
+
+    types = [ug.GetCellType(c) for c in range(ug.GetNumberOfCells())]
+    assert set(types) == {vtk.VTK_HEXAHEDRON, vtk.VTK_WEDGE}
+    volumes = cell_volumes(ug)
+    assert (volumes > 0).all()
+    assert volumes.sum() == pytest.approx(1.0)
+
+    # Aucune cellule ne contient le centre de sa voisine (faux positifs des VTK_POLYHEDRON)
+    centres = np.array([mesh["points"][list({p for f in faces for p in f})].mean(axis=0) for faces in mesh["cell_faces"]])
+    ninternal = mesh["neighbour"].size
+    for owner, neighbour in zip(mesh["owner"][:ninternal], mesh["neighbour"]):
+        assert contains(ug, owner, centres[owner])
+        assert not contains(ug, owner, centres[neighbour])
+        assert not contains(ug, neighbour, centres[owner])
+
+
+def test_overlap_weights_cover_mixed_mesh():
+    # Le remappage par recouvrement découpe aussi les prismes : chaque voxel est couvert exactement
+    mesh = extruded_mesh(5, 4, 3, jitter=0.3, seed=3)
+    ug = FoamReader().build_unstructured_grid(mesh)
+    reader = ThOutputReader()
+    bounds = (0.0, 1.0, 0.0, 1.0, 0.0, 1.0)
+
+    rows, cols, volumes, covered = reader.build_overlap_weights(reader.cell_id_source(ug), bounds, 3, 3, 2)
+
+    assert covered == pytest.approx(np.full(18, 1/18))
+    assert np.bincount(cols, weights=volumes, minlength=ug.GetNumberOfCells()) == pytest.approx(cell_volumes(ug))
+
+
+def test_ascii_face_list(tmp_path):
+    mesh = extruded_mesh(3, 2, 2, jitter=0.2, seed=5)
+    fo, fp = mesh["face_offsets"], mesh["face_points"]
+    faces = "\n".join(f"{fo[f+1] - fo[f]}({' '.join(map(str, fp[fo[f]:fo[f+1]]))})" for f in range(fo.size - 1))
+    path = tmp_path / "faces"
+    path.write_text("FoamFile\n{\n    format      ascii;\n    class       faceList;\n}\n"
+                    f"// commentaire\n\n{fo.size - 1}\n(\n{faces}\n)\n")
+
+    offsets, points = FoamReader().read_mesh_list(str(path), "faces")
+    np.testing.assert_array_equal(offsets, fo)
+    np.testing.assert_array_equal(points, fp)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+import vtk
+from Thermohydraulics.FoamReader import FoamReader
+from Thermohydraulics.ThOutputReader import ThOutputReader
+from foam_meshes import contains, extruded_mesh
+
+NX, NY, NZ = 6, 6, 4
+BOUNDS = (0.02, 0.98, 0.02, 0.98, 0.0, 1.0)
+GRID = (4, 4, 3)
+SAMPLES = 400
+SEED = 7
+
+
+@pytest.fixture(scope="module")
+def case():
+    # Maillage hexaèdres + prismes bruité, T et rho linéaires par morceaux (valeur au centre de cellule)
+    mesh = extruded_mesh(NX, NY, NZ, jitter=0.3, seed=1)
+    centres = np.array([mesh["points"][sorted({p for f in faces for p in f})].mean(axis=0) for faces in mesh["cell_faces"]])
+    fields = {"T": 550.0 + 40.0*centres[:, 0] - 25.0*centres[:, 1] + 30.0*centres[:, 2],
+              "rho_post": 750.0 - 60.0*centres[:, 2]}
+    reader = FoamReader()
+    ug = reader.add_cell_fields(reader.build_unstructured_grid(mesh), fields)
+    return mesh, ug, fields
+
+
+def true_cells(mesh, pts):
+    # Cellule exacte : couche en z puis polygone convexe de la base contenant (x, y)
+    points = mesh["points"]
+    cells_per_layer = mesh["ncells"] // NZ
+    bases = [faces[0][::-1] for faces in mesh["cell_faces"][:cells_per_layer]]
+    layer = np.clip(np.floor(pts[:, 2] * NZ).astype(np.int64), 0, NZ - 1)
+    cid = np.full(len(pts), -1, dtype=np.int64)
+    for c, base in enumerate(bases):
+        xy = points[base, :2]
+        edges = np.roll(xy, -1, axis=0) - xy
+        rel = pts[:, None, :2] - xy[None]
+        inside = (edges[None, :, 0]*rel[:, :, 1] - edges[None, :, 1]*rel[:, :, 0] >= 0).all(axis=1)
+        cid[inside] = c + layer[inside]*cells_per_layer
+    return cid
+
+
+def slab_points(reader):
+    # Mêmes tirages que monte_carlo_voxel_average (flux np.random historique, tranches j)
+    origin, spacing = reader.build_image_grid(BOUNDS, *GRID)
+    nx, ny, nz = GRID
+    np.random.seed(SEED)
+    slabs = []
+    for j in range(1, ny+1):
+        i_slab = np.repeat(np.arange(1, nx+1), nz)
+        k_slab = np.tile(np.arange(1, nz+1), nx)
+        x0, x1, y0, y1, z0, z1 = reader.voxel_bounds(origin, spacing, i_slab, j, k_slab)
+        slabs.append(reader.random_voxel_points(x0, x1, y0, y1, z0, z1, SAMPLES).reshape(-1, 3))
+    return np.concatenate(slabs)
+
+
+def voxel_means(values, cid):
+    cid = cid.reshape(-1, SAMPLES)
+    return values[cid].mean(axis=1)
+
+
+def test_probe_lookup_matches_exact_cells(case):
+    mesh, ug, fields = case
+    reader = ThOutputReader()
+    pts = slab_points(reader)
+    truth = true_cells(mesh, pts)
+
+    cid = reader.locate_cells(reader.build_cell_probe(ug), pts)
+
+    # Seuls écarts admis : points à la tolérance paramétrique de VTK d'une face partagée,
+    # contenus à la fois dans la cellule exacte et dans celle renvoyée
+    differ = np.where(cid != truth)[0]
+    assert differ.size < 2e-3 * pts.shape[0]
+    for i in differ:
+        assert contains(ug, cid[i], pts[i]) and contains(ug, truth[i], pts[i])
+
+
+def test_probe_and_findcell_paths_on_mixed_mesh(case):
+    # Chemin historique (FindCell échantillon par échantillon) contre le probe par lots
+    mesh, ug, fields = case
+    reader = ThOutputReader()
+    pts = slab_points(reader)
+    truth = true_cells(mesh, pts)
+
+    locator = vtk.vtkStaticCellLocator()
+    locator.SetDataSet(ug)
+    locator.BuildLocator()
+    find_cell = np.array([locator.FindCell(p.tolist()) for p in pts])
+
+    ix, iy, iz, T, rho, extras = reader.monte_carlo_voxel_average(ug, BOUNDS, *GRID, SAMPLES, SEED)
+
+    assert (extras["valid"] == SAMPLES).all()
+    T_exact = voxel_means(fields["T"], truth)
+    assert np.abs(T - T_exact).max() < 0.05
+    assert np.abs(rho - voxel_means(fields["rho_post"], truth)).max() < 0.05
+
+    # FindCell garde les faux positifs des VTK_WEDGE : jamais plus proche de l'exact que le probe
+    assert (find_cell >= 0).all()
+    assert np.abs(T - T_exact).max() <= np.abs(voxel_means(fields["T"], find_cell) - T_exact).max()